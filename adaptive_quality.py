@@ -0,0 +1,92 @@
+import math
+from typing import Optional
+import numpy as np
+from imagecodecs import jpegxl_encode
+
+# The proxy is a mosaic of up to PROXY_TILES x PROXY_TILES full-resolution
+# tiles spread over the image (256 px matches libjxl's group size)
+PROXY_TILE = 256
+PROXY_TILES = 4
+# Trial encodes use a low effort; the final encode uses the normal one
+SEARCH_EFFORT = 3
+FINAL_EFFORT = 5
+SEARCH_STEPS = 6
+CALIBRATION_ROUNDS = 2
+# Search range of the butteraugli distance (lower is better quality). The
+# upper end is the quality floor: targets are never met by going below it.
+MIN_DISTANCE = 0.5
+MAX_DISTANCE = 6.0
+
+def make_proxy(img_arr: np.ndarray) -> np.ndarray:
+    """Small stand-in for an image with the same detail per pixel.
+
+    Tiles are cut at full resolution rather than downscaling the whole
+    image, because downscaling packs more detail into each pixel and so
+    predicts too many bytes per pixel for the full-size encode.
+    """
+    height, width = img_arr.shape[:2]
+    tile_h, tile_w = min(PROXY_TILE, height), min(PROXY_TILE, width)
+    rows = min(PROXY_TILES, height // tile_h)
+    cols = min(PROXY_TILES, width // tile_w)
+    if rows * tile_h == height and cols * tile_w == width:
+        return img_arr
+    proxy = np.empty((rows * tile_h, cols * tile_w) + img_arr.shape[2:], dtype=img_arr.dtype)
+    tops = np.linspace(0, height - tile_h, rows).astype(int)
+    lefts = np.linspace(0, width - tile_w, cols).astype(int)
+    for i, top in enumerate(tops):
+        for j, left in enumerate(lefts):
+            proxy[i * tile_h:(i + 1) * tile_h, j * tile_w:(j + 1) * tile_w] = \
+                img_arr[top:top + tile_h, left:left + tile_w]
+    return proxy
+
+def bytes_per_pixel(proxy: np.ndarray, distance: float, numthreads: int, effort: int = SEARCH_EFFORT) -> float:
+    encoded = jpegxl_encode(proxy, distance=distance, effort=effort, numthreads=numthreads)
+    return len(encoded) / (proxy.shape[0] * proxy.shape[1])
+
+def bisect_distance(proxy: np.ndarray, target_bpp: float, numthreads: int) -> float:
+    """Bisect the distance on a log scale with trial encodes of the proxy."""
+    low, high = MIN_DISTANCE, MAX_DISTANCE
+    if bytes_per_pixel(proxy, high, numthreads) > target_bpp:
+        return high
+    if bytes_per_pixel(proxy, low, numthreads) <= target_bpp:
+        return low
+    for _ in range(SEARCH_STEPS):
+        middle = math.sqrt(low * high)
+        if bytes_per_pixel(proxy, middle, numthreads) <= target_bpp:
+            high = middle
+        else:
+            low = middle
+    return high
+
+def search_distance(img_arr: np.ndarray, target_bpp: float, numthreads: int = 1,
+                    final_effort: int = FINAL_EFFORT) -> float:
+    """Best-quality distance whose encode stays within target_bpp bytes per pixel.
+
+    Low-effort trial encodes come out larger than the final one by a ratio
+    that depends on the distance, so the search runs CALIBRATION_ROUNDS
+    times, each with the target rescaled by the ratio of the two efforts
+    measured at the previous result. Returns MAX_DISTANCE if even that is
+    over target and MIN_DISTANCE if even that is under it.
+    """
+    proxy = make_proxy(img_arr)
+    distance = math.sqrt(MIN_DISTANCE * MAX_DISTANCE)
+    for _ in range(CALIBRATION_ROUNDS if final_effort != SEARCH_EFFORT else 1):
+        ratio = 1.0
+        if final_effort != SEARCH_EFFORT:
+            ratio = (bytes_per_pixel(proxy, distance, numthreads)
+                     / bytes_per_pixel(proxy, distance, numthreads, final_effort))
+        distance = bisect_distance(proxy, target_bpp * ratio, numthreads)
+    return round(distance, 3)
+
+def adaptive_distance(img_arr: np.ndarray, target_bpp: float, content_hash: Optional[str] = None,
+                      cache=None, numthreads: int = 1) -> float:
+    """search_distance, remembered in the media cache per source content hash and target."""
+    key = f"jxl_distance:{content_hash}:{img_arr.dtype}:{target_bpp}"
+    if cache is not None and content_hash:
+        cached = cache.get_derived(key)
+        if cached is not None:
+            return float(cached)
+    distance = search_distance(img_arr, target_bpp, numthreads)
+    if cache is not None and content_hash:
+        cache.put_derived(key, str(distance))
+    return distance
@@ -1,95 +1,549 @@
 import os
 from PIL import Image
-import glob
-from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 import multiprocessing
-import random
-from typing import List, Tuple
-
-def get_random_pixel_coordinates(width: int, height: int, sample_size: int = 1000) -> List[Tuple[int, int]]:
-    """Generate random pixel coordinates for checking."""
-    total_pixels = width * height
-    sample_size = min(sample_size, total_pixels)
-    coordinates = [(random.randint(0, width-1), random.randint(0, height-1)) 
-                  for _ in range(sample_size)]
-    return coordinates
-
-def is_image_all_black(image_path: str) -> Tuple[str, bool]:
-    """Check if image is all black using random sampling. Returns tuple of (path, result)."""
+import queue
+import struct
+import sys
+import threading
+import time
+import zlib
+import numpy as np
+import tifffile
+from media_cache import DEFAULT_CACHE_PATH, MediaCache
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.tif', '.tiff', '.bmp', '.ppm', '.pgm'}
+
+# Modes whose bands can be checked for zero directly, without a converted copy
+NATIVE_MODES = {'1', 'L', 'LA', 'La', 'I', 'I;16', 'I;16L', 'I;16B', 'I;16N', 'F',
+                'RGB', 'RGBA', 'RGBa', 'RGBX'}
+
+# Bytes per row block examined before deciding to bail out early
+ROW_BLOCK_BYTES = 1 << 20
+# Approximate number of pixels looked at by the strided pre-check
+SAMPLE_PIXELS = 4096
+# JPEG previews are decoded at 1/PREVIEW_SCALE of the size via DCT scaling
+PREVIEW_SCALE = 8
+# Upper bound on inflated PNG data held at once by the streaming check
+STREAM_CHUNK_BYTES = 4 << 20
+# Adaptive batches aim to keep a worker busy for about this long per task
+TARGET_BATCH_SECONDS = 0.5
+MAX_BATCH_SIZE = 256
+# Progress is printed at most once per interval (seconds)
+PROGRESS_INTERVAL = 1.0
+
+
+class RawRegion(NamedTuple):
+    """A block of uncompressed pixel rows at a fixed offset in an image file."""
+    offset: int
+    rows: int
+    row_stride: int
+    width: int
+    channels: int
+    color: int
+    dtype: np.dtype
+    maxval: Optional[int]
+
+
+def iter_row_blocks(arr: np.ndarray) -> Iterator[np.ndarray]:
+    """Yield consecutive row blocks of an image array, about ROW_BLOCK_BYTES each."""
+    row_bytes = max(1, arr.nbytes // max(1, arr.shape[0]))
+    rows = max(1, ROW_BLOCK_BYTES // row_bytes)
+    for y in range(0, arr.shape[0], rows):
+        yield arr[y:y + rows]
+
+
+def sample_view(arr: np.ndarray) -> np.ndarray:
+    """Strided view over the array covering roughly SAMPLE_PIXELS pixels, no copy."""
+    height, width = arr.shape[:2]
+    step = max(1, int((height * width / SAMPLE_PIXELS) ** 0.5))
+    return arr[::step, ::step]
+
+
+def value_limit(dtype: np.dtype, threshold: int, maxval: Optional[int] = None) -> float:
+    """Translate an 8-bit black threshold into the value range of the given dtype."""
+    if dtype.kind == 'f':
+        return threshold / 255
+    if dtype.kind == 'b':
+        return 0 if threshold < 255 else 1
+    if maxval is None:
+        maxval = 255 if dtype.itemsize == 1 else np.iinfo(dtype).max
+    return threshold * maxval // 255
+
+
+def exceeds(arr: np.ndarray, limit: float) -> bool:
+    """True if any value in the array is above the limit."""
+    if arr.size == 0:
+        return False
+    return bool(arr.any()) if limit == 0 else bool(arr.max() > limit)
+
+
+def array_is_black(arr: np.ndarray, threshold: int = 0, maxval: Optional[int] = None) -> bool:
+    """Check that no value in the array is above the threshold, sampling first and then block by block."""
+    limit = value_limit(arr.dtype, threshold, maxval)
+    if exceeds(sample_view(arr), limit):
+        return False
+    return not any(exceeds(block, limit) for block in iter_row_blocks(arr))
+
+
+def palette_is_black(img: Image.Image, threshold: int = 0) -> bool:
+    """Check a palette image by mapping its indices through a black/not-black lookup table."""
+    palette = img.getpalette() or []
+    black_lut = np.zeros(256, dtype=bool)
+    for index in range(min(256, len(palette) // 3)):
+        black_lut[index] = max(palette[index * 3:index * 3 + 3]) <= threshold
+
+    indices = np.asarray(img)
+    if not black_lut[sample_view(indices)].all():
+        return False
+    return all(black_lut[block].all() for block in iter_row_blocks(indices))
+
+
+def image_is_black(img: Image.Image, threshold: int = 0) -> bool:
+    """Check an opened image in its native mode. Alpha and padding bands are ignored."""
+    if img.mode == 'P':
+        return palette_is_black(img, threshold)
+
+    bands = img.getbands()
+    if img.mode not in NATIVE_MODES:
+        # CMYK, YCbCr, LAB... have no direct "zero means black" layout
+        img = img.convert('RGB')
+        bands = img.getbands()
+
+    arr = np.asarray(img)
+    if arr.ndim == 3:
+        color = [i for i, band in enumerate(bands) if band not in ('A', 'a', 'X')]
+        if len(color) < arr.shape[2]:
+            arr = arr[..., :len(color)]
+    return array_is_black(arr, threshold)
+
+
+def jpeg_preview_is_black(img: Image.Image, threshold: int = 0) -> bool:
+    """Decode a JPEG at reduced DCT scale and check the preview.
+
+    Only ever used to reject: a non-black preview means a non-black image,
+    a black preview still needs the full confirmation pass. That pass is a
+    whole-image decode, since Pillow cannot decode a JPEG in strips, so a
+    black JPEG costs its full decoded size in memory once; scaled decodes
+    average pixels away and cannot confirm exactly.
+    """
+    img.draft(None, (max(1, img.width // PREVIEW_SCALE), max(1, img.height // PREVIEW_SCALE)))
+    return image_is_black(img, threshold)
+
+
+def png_stream_is_black(image_path: str, threshold: int = 0) -> Optional[bool]:
+    """Inflate the PNG pixel stream in bounded chunks and check the filtered scanlines.
+
+    With every PNG filter a zero sample predicts to zero, so the filtered
+    bytes are all zero exactly when the pixels are. That lets us skip
+    unfiltering altogether. Returns None for layouts this cannot decide
+    (palette, alpha, interlaced, non-zero threshold), in which case the
+    caller decodes normally.
+    """
+    if threshold:
+        return None
+    with open(image_path, 'rb') as f:
+        if f.read(8) != b'\x89PNG\r\n\x1a\n':
+            return None
+        length, chunk_type = struct.unpack('>I4s', f.read(8))
+        if chunk_type != b'IHDR':
+            return None
+        width, height, bit_depth, color_type, _, _, interlace = struct.unpack('>IIBBBBB', f.read(13))
+        f.seek(length - 13 + 4, os.SEEK_CUR)
+        if color_type not in (0, 2) or interlace:
+            return None
+
+        channels = 3 if color_type == 2 else 1
+        row_bytes = 1 + (width * channels * bit_depth + 7) // 8
+        inflater = zlib.decompressobj()
+        pending = b''
+        rows_seen = 0
+        while rows_seen < height:
+            header = f.read(8)
+            if len(header) < 8:
+                return None
+            length, chunk_type = struct.unpack('>I4s', header)
+            if chunk_type == b'IEND':
+                break
+            if chunk_type != b'IDAT':
+                f.seek(length + 4, os.SEEK_CUR)
+                continue
+            data = f.read(length)
+            f.seek(4, os.SEEK_CUR)
+            while data:
+                pending += inflater.decompress(data, STREAM_CHUNK_BYTES)
+                data = inflater.unconsumed_tail
+                rows = len(pending) // row_bytes
+                if rows:
+                    scanlines = np.frombuffer(pending, dtype=np.uint8, count=rows * row_bytes)
+                    if scanlines.reshape(rows, row_bytes)[:, 1:].any():
+                        return False
+                    pending = pending[rows * row_bytes:]
+                    rows_seen += rows
+        return rows_seen >= height
+
+
+def tiff_stream_is_black(image_path: str, threshold: int = 0) -> Optional[bool]:
+    """Decode a TIFF one strip or tile at a time. Returns None for unsupported layouts."""
+    with tifffile.TiffFile(image_path) as tif:
+        page = tif.pages[0]
+        if page.photometric not in (tifffile.PHOTOMETRIC.MINISBLACK, tifffile.PHOTOMETRIC.RGB):
+            return None
+        color = page.samplesperpixel - len(page.extrasamples)
+        limit = value_limit(page.dtype, threshold)
+        if page.planarconfig == tifffile.PLANARCONFIG.SEPARATE and page.extrasamples:
+            return None
+        for segment, _, _ in page.segments(maxworkers=1):
+            if segment is None:
+                continue
+            if segment.ndim == 4 and page.planarconfig == tifffile.PLANARCONFIG.CONTIG:
+                segment = segment[..., :color]
+            if exceeds(segment, limit):
+                return False
+        return True
+
+
+def bmp_regions(data: np.ndarray) -> Optional[List[RawRegion]]:
+    """Pixel region of an uncompressed 24/32-bit BMP."""
+    if data.size < 54 or bytes(data[:2]) != b'BM':
+        return None
+    pixel_offset, dib_size = struct.unpack_from('<II', data, 10)
+    if dib_size < 40:
+        return None
+    width, height, _, bpp, compression = struct.unpack_from('<iiHHI', data, 18)
+    if compression != 0 or bpp not in (24, 32) or width <= 0:
+        return None
+    # Rows are padded to 4 bytes; a 32-bit BI_RGB pixel is BGRX
+    row_stride = (width * bpp + 31) // 32 * 4
+    return [RawRegion(pixel_offset, abs(height), row_stride, width, bpp // 8, 3, np.dtype('u1'), None)]
+
+
+def pnm_regions(data: np.ndarray) -> Optional[List[RawRegion]]:
+    """Pixel region of a binary PGM (P5) or PPM (P6)."""
+    magic = bytes(data[:2])
+    if magic not in (b'P5', b'P6'):
+        return None
+    header = bytes(data[:1024])
+    tokens = []
+    pos = 2
+    while len(tokens) < 3:
+        while pos < len(header) and header[pos:pos + 1].isspace():
+            pos += 1
+        if header[pos:pos + 1] == b'#':
+            pos = header.index(b'\n', pos)
+            continue
+        end = pos
+        while end < len(header) and not header[end:end + 1].isspace():
+            end += 1
+        if end == pos:
+            return None
+        tokens.append(int(header[pos:end]))
+        pos = end
+    width, height, maxval = tokens
+    # Exactly one whitespace byte separates the header from the raster
+    channels = 3 if magic == b'P6' else 1
+    dtype = np.dtype('u1') if maxval < 256 else np.dtype('>u2')
+    row_bytes = width * channels * dtype.itemsize
+    return [RawRegion(pos + 1, height, row_bytes, width, channels, channels, dtype, maxval)]
+
+
+def tiff_regions(data: np.ndarray) -> Optional[List[RawRegion]]:
+    """Strip regions of an uncompressed, chunky, 8/16-bit gray or RGB TIFF."""
+    order = bytes(data[:2])
+    if order not in (b'II', b'MM'):
+        return None
+    bo = '<' if order == b'II' else '>'
+    magic, ifd_offset = struct.unpack_from(bo + 'HI', data, 2)
+    if magic != 42:
+        return None
+
+    tags = {}
+    count, = struct.unpack_from(bo + 'H', data, ifd_offset)
+    for i in range(count):
+        tag, value_type, value_count = struct.unpack_from(bo + 'HHI', data, ifd_offset + 2 + i * 12)
+        if value_type not in (3, 4):
+            continue
+        fmt = 'H' if value_type == 3 else 'I'
+        value_offset = ifd_offset + 2 + i * 12 + 8
+        if value_count * struct.calcsize(fmt) > 4:
+            value_offset, = struct.unpack_from(bo + 'I', data, value_offset)
+        tags[tag] = struct.unpack_from(f"{bo}{value_count}{fmt}", data, value_offset)
+
+    width, height = tags.get(256, (0,))[0], tags.get(257, (0,))[0]
+    bits = set(tags.get(258, (1,)))
+    samples = tags.get(277, (1,))[0]
+    extra = len(tags.get(338, ()))
+    if (tags.get(259, (1,))[0] != 1 or tags.get(262, (None,))[0] not in (1, 2)
+            or tags.get(284, (1,))[0] != 1 or tags.get(339, (1,))[0] != 1
+            or 322 in tags or len(bits) != 1 or bits.pop() not in (8, 16)
+            or 273 not in tags or not width):
+        return None
+
+    dtype = np.dtype(bo + ('u1' if tags[258][0] == 8 else 'u2'))
+    rows_per_strip = min(tags.get(278, (height,))[0], height)
+    row_bytes = width * samples * dtype.itemsize
+    regions = []
+    for index, offset in enumerate(tags[273]):
+        rows = min(rows_per_strip, height - index * rows_per_strip)
+        if rows > 0:
+            regions.append(RawRegion(offset, rows, row_bytes, width, samples, samples - extra, dtype, None))
+    return regions
+
+
+RAW_PARSERS = {
+    '.bmp': bmp_regions,
+    '.ppm': pnm_regions,
+    '.pgm': pnm_regions,
+    '.tif': tiff_regions,
+    '.tiff': tiff_regions,
+}
+
+
+def raw_is_black(image_path: str, threshold: int = 0) -> Optional[bool]:
+    """Check an uncompressed image straight from a memory map of the file, without decoding.
+
+    Returns None when the header describes a layout that needs a real decoder.
+    """
+    parser = RAW_PARSERS.get(os.path.splitext(image_path)[1].lower())
+    if parser is None or os.path.getsize(image_path) == 0:
+        return None
+    data = np.memmap(image_path, dtype=np.uint8, mode='r')
+    regions = parser(data)
+    if not regions:
+        return None
+
+    for region in regions:
+        end = region.offset + region.rows * region.row_stride
+        if end > data.size:
+            return None
+        rows = data[region.offset:end].reshape(region.rows, region.row_stride)
+        pixel_bytes = region.width * region.channels * region.dtype.itemsize
+        pixels = rows[:, :pixel_bytes].view(region.dtype).reshape(region.rows, region.width, region.channels)
+        if not array_is_black(pixels[..., :region.color], threshold, region.maxval):
+            return False
+    return True
+
+
+STREAM_CHECKS = {
+    'PNG': png_stream_is_black,
+    'TIFF': tiff_stream_is_black,
+}
+
+
+def is_image_all_black(image_path: str, threshold: int = 0) -> Tuple[str, Optional[bool]]:
+    """Check if no pixel is brighter than threshold (0 = pure black). Returns tuple of (path, result).
+
+    The result is None when the image could not be read, so that an error
+    is neither taken for a verdict nor cached as one.
+
+    Uncompressed BMP/PPM/PGM/TIFF are checked from a memory map without
+    decoding. Otherwise a reduced JPEG preview rejects most images up front,
+    and PNG and TIFF are confirmed in streamed chunks so memory stays bounded.
+    Everything else, including a JPEG whose preview is black, falls back to
+    a full decode checked block by block, so memory there grows with the
+    image size.
+    """
     try:
+        result = raw_is_black(image_path, threshold)
+        if result is not None:
+            return (image_path, result)
+
+        with Image.open(image_path) as img:
+            image_format = img.format
+            if image_format == 'JPEG' and not jpeg_preview_is_black(img, threshold):
+                return (image_path, False)
+            if image_format not in STREAM_CHECKS and image_format != 'JPEG':
+                return (image_path, image_is_black(img, threshold))
+
+        if image_format in STREAM_CHECKS:
+            result = STREAM_CHECKS[image_format](image_path, threshold)
+            if result is not None:
+                return (image_path, result)
+
         with Image.open(image_path) as img:
-            if img.mode != 'RGB':
-                img = img.convert('RGB')
-            
-            pixels = img.load()
-            width, height = img.size
-            
-            # Random sampling first
-            coordinates = get_random_pixel_coordinates(width, height)
-            for x, y in coordinates:
-                r, g, b = pixels[x, y]
-                if r != 0 or g != 0 or b != 0:
-                    return (image_path, False)
-            
-            # Full check only if random sample is all black
-            for x in range(width):
-                for y in range(height):
-                    r, g, b = pixels[x, y]
-                    if r != 0 or g != 0 or b != 0:
-                        return (image_path, False)
-            return (image_path, True)
+            return (image_path, image_is_black(img, threshold))
     except Exception as e:
         print(f"Error processing {image_path}: {str(e)}")
-        return (image_path, False)
-
-def process_chunk(image_paths: List[str]) -> List[Tuple[str, bool]]:
-    """Process a chunk of images and return results."""
-    return [is_image_all_black(path) for path in image_paths]
-
-def chunk_list(lst: List, chunk_size: int) -> List[List]:
-    """Split a list into chunks of specified size."""
-    return [lst[i:i + chunk_size] for i in range(0, len(lst), chunk_size)]
-
-def process_images(folder_path: str) -> List[str]:
-    """Find all black images in the given folder using process pool."""
-    # Get all images
-    image_types = ('*.jpg', '*.jpeg', '*.png', '*.gif')
-    images = []
-    for ext in image_types:
-        images.extend(glob.glob(os.path.join(folder_path, ext)))
-    
-    if not images:
-        return []
-    
-    # Calculate optimal number of processes and chunk size
+        return (image_path, None)
+
+
+def peak_memory_bytes(include_children: bool = False) -> Optional[int]:
+    """Peak resident memory of the current process, or None if it cannot be measured.
+
+    With include_children, the peak of any child process it waited for
+    (e.g. an encoder binary) counts too, where the OS reports it.
+    """
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if include_children:
+            peak = max(peak, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+        return peak if sys.platform == 'darwin' else peak * 1024
+    except ImportError:
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().peak_wset
+    except (ImportError, AttributeError):
+        return None
+
+
+def process_chunk(image_paths: List[str], threshold: int = 0) -> Tuple[List[Tuple[str, Optional[bool]]], int, Optional[int], float]:
+    """Process a chunk of images. Returns (results, worker pid, worker peak memory, seconds spent)."""
+    started = time.perf_counter()
+    results = [is_image_all_black(path, threshold) for path in image_paths]
+    return results, os.getpid(), peak_memory_bytes(), time.perf_counter() - started
+
+
+def iter_images(folder_path: str) -> Iterator[os.DirEntry]:
+    """Recursively yield directory entries of images under folder_path as they are discovered."""
+    pending_dirs = [folder_path]
+    while pending_dirs:
+        directory = pending_dirs.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        pending_dirs.append(entry.path)
+                    elif os.path.splitext(entry.name)[1].lower() in IMAGE_EXTENSIONS and entry.is_file():
+                        yield entry
+        except OSError as e:
+            print(f"Error scanning {directory}: {str(e)}")
+
+
+def discover_images(folder_path: str, work_queue: queue.Queue, threshold: int,
+                    cache: Optional[MediaCache]) -> None:
+    """Feed (path, cached verdict or None) into the bounded work queue, then a None sentinel.
+
+    cache is the caller's MediaCache, which is safe to share between threads.
+    """
+    try:
+        for entry in iter_images(folder_path):
+            verdict = None
+            if cache is not None:
+                cached = cache.get(entry.path, entry.stat())
+                if cached and cached['black'] is not None and cached['black_threshold'] == threshold:
+                    verdict = bool(cached['black'])
+            work_queue.put((entry.path, verdict))
+    finally:
+        work_queue.put(None)
+
+
+def take_batch(work_queue: queue.Queue, size: int, block: bool) -> Tuple[List[str], List[Tuple[str, bool]], bool]:
+    """Take up to size uncached paths from the queue.
+
+    Returns (batch, cached results met on the way, discovery finished).
+    """
+    batch = []
+    cached = []
+    while len(batch) < size:
+        try:
+            item = work_queue.get(block=block and not batch and not cached, timeout=PROGRESS_INTERVAL)
+        except queue.Empty:
+            break
+        if item is None:
+            return batch, cached, True
+        image_path, verdict = item
+        if verdict is None:
+            batch.append(image_path)
+        else:
+            cached.append((image_path, verdict))
+    return batch, cached, False
+
+
+def process_images(folder_path: str, threshold: int = 0,
+                   cache_path: Optional[str] = DEFAULT_CACHE_PATH) -> List[str]:
+    """Find all black images under the given folder using a streaming process pool.
+
+    Discovery runs in a background thread and fills a bounded queue. Batches
+    are sized from measured per-image time, so each task takes roughly
+    TARGET_BATCH_SECONDS. Results are consumed as soon as any batch finishes.
+    Verdicts are kept in the shared media cache, so unchanged files are not
+    decoded again on later runs; pass cache_path=None to disable it.
+    """
     num_processes = multiprocessing.cpu_count()
-    chunk_size = max(1, len(images) // (num_processes * 2))  # Ensure enough chunks for all processes
-    image_chunks = chunk_list(images, chunk_size)
-    
+    max_in_flight = num_processes * 2
+    work_queue = queue.Queue(maxsize=num_processes * MAX_BATCH_SIZE)
+    cache = MediaCache(cache_path) if cache_path else None
+    discovery = threading.Thread(target=discover_images,
+                                 args=(folder_path, work_queue, threshold, cache), daemon=True)
+    discovery.start()
+
     black_images = []
+    cached_count = 0
+    worker_peaks = {}
     processed_count = 0
-    total_images = len(images)
-    
-    # Process images in parallel using ProcessPoolExecutor
+    batch_size = 1
+    seconds_per_image = None
+    discovery_done = False
+    started = last_report = time.monotonic()
+
     with ProcessPoolExecutor(max_workers=num_processes) as executor:
-        # Submit all chunks for processing
-        future_to_chunk = {executor.submit(process_chunk, chunk): chunk 
-                          for chunk in image_chunks}
-        
-        # Process results as they complete
-        for future in future_to_chunk:
-            try:
-                results = future.result()
-                for image_path, is_black in results:
-                    processed_count += 1
-                    if is_black:
-                        black_images.append(image_path)
-                    print(f"Progress: {processed_count}/{total_images} - Checked: {os.path.basename(image_path)}")
-            except Exception as e:
-                print(f"Error processing chunk: {str(e)}")
+        in_flight = set()
+        while True:
+            # Keep the pool topped up; only block on discovery when nothing is running
+            while not discovery_done and len(in_flight) < max_in_flight:
+                batch, cached, discovery_done = take_batch(work_queue, batch_size, block=not in_flight)
+                processed_count += len(cached)
+                cached_count += len(cached)
+                black_images.extend(image_path for image_path, is_black in cached if is_black)
+                if not batch:
+                    if cached:
+                        continue
+                    break
+                in_flight.add(executor.submit(process_chunk, batch, threshold))
+
+            if not in_flight:
+                if discovery_done:
+                    break
+                continue
+
+            finished, in_flight = wait(in_flight, timeout=PROGRESS_INTERVAL, return_when=FIRST_COMPLETED)
+            for future in finished:
+                try:
+                    results, worker_pid, peak, seconds = future.result()
+                except Exception as e:
+                    print(f"Error processing chunk: {str(e)}")
+                    continue
+                if peak is not None:
+                    worker_peaks[worker_pid] = max(peak, worker_peaks.get(worker_pid, 0))
+                if results:
+                    # Exponential moving average of the cost of one image
+                    sample = seconds / len(results)
+                    seconds_per_image = sample if seconds_per_image is None else 0.8 * seconds_per_image + 0.2 * sample
+                    batch_size = max(1, min(MAX_BATCH_SIZE, int(TARGET_BATCH_SECONDS / max(seconds_per_image, 1e-6))))
+                processed_count += len(results)
+                black_images.extend(image_path for image_path, is_black in results if is_black)
+                if cache is not None:
+                    for image_path, is_black in results:
+                        if is_black is None:
+                            # Read errors are retried on the next run
+                            continue
+                        try:
+                            cache.put(image_path, black=int(is_black), black_threshold=threshold)
+                        except OSError:
+                            pass
+
+            now = time.monotonic()
+            if now - last_report >= PROGRESS_INTERVAL:
+                last_report = now
+                rate = processed_count / max(now - started, 1e-6)
+                print(f"Progress: {processed_count} checked, {len(black_images)} black, "
+                      f"{rate:.0f} images/s, batch size {batch_size}")
+
+    if cache is not None:
+        discovery.join()
+        cache.close()
+    print(f"Checked {processed_count} images ({cached_count} from cache) in {time.monotonic() - started:.1f}s")
+    if worker_peaks:
+        peaks_mb = [peak / (1024 * 1024) for peak in worker_peaks.values()]
+        print(f"\nPeak memory per worker: max {max(peaks_mb):.1f} MB, "
+              f"mean {sum(peaks_mb) / len(peaks_mb):.1f} MB over {len(peaks_mb)} workers")
     
     return black_images
 
+
 def main():
     # Get folder path from user
     folder_path = input("Enter folder path: ").strip()
@@ -99,8 +553,15 @@ def main():
         print("Error: Invalid folder path")
         return
     
-    print(f"\nAnalyzing images using {multiprocessing.cpu_count()} processes...")
-    black_images = process_images(folder_path)
+    # Optional tolerance for near-black frames (sensor noise, compression)
+    try:
+        threshold = int(input("Black threshold 0-255 (press Enter for 0 = pure black): ").strip() or 0)
+    except ValueError:
+        print("Error: Threshold must be a number")
+        return
+    
+    print(f"\nAnalyzing images (including subfolders) using {multiprocessing.cpu_count()} processes...")
+    black_images = process_images(folder_path, threshold)
     
     # If no images to delete
     if not black_images:
@@ -110,26 +571,29 @@ def main():
     # Show images to be deleted
     print(f"\nThe following {len(black_images)} images are completely black and will be deleted:")
     for image_path in black_images:
-        print(f"- {os.path.basename(image_path)}")
+        print(f"- {os.path.relpath(image_path, folder_path)}")
     
     # Ask for confirmation
     confirm = input("\nDo you want to delete these images? (y/n): ").strip().lower()
     
     if confirm == 'y':
         print("\nDeleting images...")
+        deleted = []
         for image_path in black_images:
             try:
                 os.remove(image_path)
-                print(f"Deleted: {os.path.basename(image_path)}")
+                deleted.append(image_path)
+                print(f"Deleted: {os.path.relpath(image_path, folder_path)}")
             except Exception as e:
-                print(f"Failed to delete {os.path.basename(image_path)}: {str(e)}")
+                print(f"Failed to delete {os.path.relpath(image_path, folder_path)}: {str(e)}")
+        with MediaCache() as cache:
+            cache.forget(deleted)
         print("\nDeletion complete.")
     else:
         print("\nOperation cancelled.")
 
+
 if __name__ == "__main__":
-    # Set random seed for reproducibility
-    random.seed()
     # Required for Windows systems
     multiprocessing.freeze_support()
     main()
\ No newline at end of file
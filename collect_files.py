@@ -1,59 +1,258 @@
 import os
 import shutil
+import stat
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from pathlib import Path
+from dedupe import ACTIONS, find_duplicates
+from media_cache import MediaCache
+
+# Threads used for copies when source and destination are on different devices
+COPY_WORKERS = min(8, (os.cpu_count() or 1) * 2)
+# Cross-device copies are flushed to disk, and only then their sources removed, in batches
+SYNC_BATCH_FILES = 256
+SYNC_BATCH_BYTES = 1 << 30
+COPY_CHUNK = 64 << 20
+# Progress is printed at most once per interval (seconds)
+PROGRESS_INTERVAL = 1.0
+
+class DestinationIndex:
+    """Free names in the destination folder, from a single directory listing.
+
+    Duplicates get name_1, name_2... as before, but the next counter per name
+    is remembered, so thousands of IMG_0001.jpg cost no extra stats.
+    """
+
+    def __init__(self, folder: Path):
+        self.folder = folder
+        with os.scandir(folder) as entries:
+            self.taken = {entry.name.casefold() for entry in entries}
+        self.next_counter = {}
+
+    def assign(self, name: str) -> Path:
+        stem, suffix = os.path.splitext(name)
+        candidate = name
+        counter = self.next_counter.get(name.casefold(), 0)
+        if counter or candidate.casefold() in self.taken:
+            counter = max(counter, 1)
+            candidate = f"{stem}_{counter}{suffix}"
+            while candidate.casefold() in self.taken:
+                counter += 1
+                candidate = f"{stem}_{counter}{suffix}"
+        self.next_counter[name.casefold()] = counter + 1
+        self.taken.add(candidate.casefold())
+        return self.folder / candidate
+
+def scan_sources(current_dir: Path, dest_folder: Path):
+    """Yield (path, lstat) of every file below current_dir, skipping the destination folder."""
+    for root, dirs, files in os.walk(current_dir):
+        root_path = Path(root)
+        # Skip the destination folder itself
+        dirs[:] = [d for d in dirs if root_path / d != dest_folder]
+        for file in files:
+            source_file = root_path / file
+            try:
+                yield source_file, source_file.lstat()
+            except OSError as e:
+                print(f"Error reading {source_file}: {e}")
+
+def copy_file_data(source_file: Path, dest_file: Path) -> int:
+    """Copy a file using in-kernel copies where the OS has them, then its timestamps.
+
+    Returns the number of bytes copied. The destination must not exist yet;
+    a partial copy is removed again if anything fails.
+    """
+    try:
+        size = _copy_contents(source_file, dest_file)
+        shutil.copystat(source_file, dest_file)
+    except BaseException:
+        dest_file.unlink(missing_ok=True)
+        raise
+    return size
+
+def _copy_contents(source_file: Path, dest_file: Path) -> int:
+    with open(source_file, 'rb') as fsrc, open(dest_file, 'xb') as fdst:
+        size = os.fstat(fsrc.fileno()).st_size
+        offset = 0
+        if hasattr(os, 'copy_file_range'):
+            try:
+                while offset < size:
+                    copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), min(COPY_CHUNK, size - offset))
+                    if copied == 0:
+                        break
+                    offset += copied
+            except OSError:
+                # Not supported between these filesystems; continue below
+                pass
+        if offset < size and sys.platform.startswith('linux'):
+            try:
+                while offset < size:
+                    copied = os.sendfile(fdst.fileno(), fsrc.fileno(), offset, min(COPY_CHUNK, size - offset))
+                    if copied == 0:
+                        break
+                    offset += copied
+            except OSError:
+                pass
+        if offset < size:
+            fsrc.seek(offset)
+            fdst.seek(offset)
+            shutil.copyfileobj(fsrc, fdst, COPY_CHUNK)
+        if not hasattr(os, 'sync'):
+            # No system-wide sync (Windows): flush each file before its source goes away
+            fdst.flush()
+            os.fsync(fdst.fileno())
+    return size
+
+def flush_copied(batch):
+    """Make a batch of copies durable, then delete their sources."""
+    if hasattr(os, 'sync'):
+        os.sync()
+    removed = 0
+    for source_file, dest_file in batch:
+        try:
+            os.remove(source_file)
+            removed += 1
+        except OSError as e:
+            print(f"Copied but could not remove {source_file}: {e}")
+    batch.clear()
+    return removed
 
 def organize_files():
     # Get current working directory
     current_dir = Path.cwd()
-    
+
     # Ask for destination folder name
     dest_folder_name = input("Enter destination folder name (press Enter for 'collected_files'): ").strip()
     if not dest_folder_name:
         dest_folder_name = "collected_files"
-    
+
     # Create destination folder if it doesn't exist
     dest_folder = current_dir / dest_folder_name
     dest_folder.mkdir(exist_ok=True)
-    
-    # Counter for moved files
+    dest_device = dest_folder.stat().st_dev
+    index = DestinationIndex(dest_folder)
+
+    # Ask what to do with byte-identical copies of files already collected or seen earlier
+    dedupe_action = input("Byte-identical duplicates: skip (leave in place), delete or hardlink? "
+                          "(press Enter to move them like any other file): ").strip().lower()
+    sources = scan_sources(current_dir, dest_folder)
+    redundant = {}
+    if dedupe_action in ACTIONS:
+        sources = list(sources)
+        # Links are not counted: their real source must not look like a redundant copy of them
+        existing = [(entry.path, entry.stat(follow_symlinks=False).st_size) for entry in os.scandir(dest_folder)
+                    if entry.is_file(follow_symlinks=False)]
+        with MediaCache() as cache:
+            groups = find_duplicates(existing + [(path, st.st_size) for path, st in sources
+                                                 if stat.S_ISREG(st.st_mode)], cache)
+        redundant = {duplicate: keeper for keeper, *duplicates in groups for duplicate in duplicates
+                     if duplicate.parent != dest_folder}
+        print(f"Found {len(redundant)} byte-identical duplicates")
+    keeper_sources = set(redundant.values())
+    collected_as = {}
+    deferred_links = []
+    duplicates_handled = 0
+
+    # Counters for moved files and bytes
     moved_files = 0
-    
-    # Recursively find all files in all subdirectories
-    for root, dirs, files in os.walk(current_dir):
-        root_path = Path(root)
-        
-        # Skip the destination folder itself
-        if root_path == dest_folder:
-            continue
-            
-        # Process each file in current directory
-        for file in files:
-            source_file = root_path / file
-            dest_file = dest_folder / file
-            
-            # Handle duplicate filenames
-            if dest_file.exists():
-                base = dest_file.stem
-                suffix = dest_file.suffix
-                counter = 1
-                while dest_file.exists():
-                    dest_file = dest_folder / f"{base}_{counter}{suffix}"
-                    counter += 1
-            
-            # Move the file
+    moved_bytes = 0
+    started = last_report = time.monotonic()
+
+    def report(force=False):
+        nonlocal last_report
+        now = time.monotonic()
+        if force or now - last_report >= PROGRESS_INTERVAL:
+            last_report = now
+            rate = moved_bytes / max(now - started, 1e-6) / (1024 * 1024)
+            print(f"Moved {moved_files} files, {moved_bytes / (1024 * 1024):.1f} MB ({rate:.1f} MB/s)")
+
+    copied_batch = []
+    copied_batch_bytes = 0
+    in_flight = {}
+
+    def collect(done):
+        nonlocal moved_files, moved_bytes, copied_batch_bytes
+        for future in done:
+            source_file, dest_file = in_flight.pop(future)
             try:
-                shutil.move(str(source_file), str(dest_file))
-                moved_files += 1
-                print(f"Moved: {source_file} -> {dest_file}")
+                size = future.result()
             except Exception as e:
                 print(f"Error moving {source_file}: {e}")
-    
+                continue
+            copied_batch.append((source_file, dest_file))
+            copied_batch_bytes += size
+            moved_files += 1
+            moved_bytes += size
+        if len(copied_batch) >= SYNC_BATCH_FILES or copied_batch_bytes >= SYNC_BATCH_BYTES:
+            flush_copied(copied_batch)
+            copied_batch_bytes = 0
+
+    # Same-device files are renamed in place; others are copied on a thread pool
+    with ThreadPoolExecutor(max_workers=COPY_WORKERS) as executor:
+        for source_file, source_stat in sources:
+            if source_file in redundant:
+                if dedupe_action == 'delete':
+                    try:
+                        if os.path.samefile(source_file, redundant[source_file]):
+                            # A hard link to the copy being kept, not a second copy
+                            continue
+                        os.remove(source_file)
+                        duplicates_handled += 1
+                    except OSError as e:
+                        print(f"Error deleting duplicate {source_file}: {e}")
+                elif dedupe_action == 'hardlink':
+                    # Linked once the copy it points to has landed in the destination
+                    deferred_links.append((source_file, redundant[source_file]))
+                continue
+
+            dest_file = index.assign(source_file.name)
+            if source_file in keeper_sources:
+                collected_as[source_file] = dest_file
+            if source_stat.st_dev == dest_device or stat.S_ISLNK(source_stat.st_mode):
+                try:
+                    if stat.S_ISLNK(source_stat.st_mode):
+                        # Links are recreated, not followed
+                        shutil.move(str(source_file), str(dest_file))
+                    else:
+                        os.rename(source_file, dest_file)
+                    moved_files += 1
+                    moved_bytes += source_stat.st_size
+                except Exception as e:
+                    print(f"Error moving {source_file}: {e}")
+            else:
+                in_flight[executor.submit(copy_file_data, source_file, dest_file)] = (source_file, dest_file)
+                if len(in_flight) >= COPY_WORKERS * 4:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    collect(done)
+            report()
+
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            collect(done)
+            report()
+    flush_copied(copied_batch)
+
+    for source_file, keeper in deferred_links:
+        dest_file = index.assign(source_file.name)
+        try:
+            os.link(collected_as.get(keeper, keeper), dest_file)
+            os.remove(source_file)
+            duplicates_handled += 1
+        except OSError as e:
+            print(f"Error linking duplicate {source_file}: {e}")
+    report(force=True)
+    if dedupe_action == 'skip':
+        print(f"{len(redundant)} duplicates left in place")
+    elif redundant:
+        print(f"{duplicates_handled} of {len(redundant)} duplicates {'deleted' if dedupe_action == 'delete' else 'hardlinked'}")
+
     print(f"\nOperation completed! {moved_files} files moved to '{dest_folder_name}'")
-    
+
 if __name__ == "__main__":
     try:
         organize_files()
     except KeyboardInterrupt:
         print("\nOperation cancelled by user")
     except Exception as e:
-        print(f"\nAn error occurred: {e}")
\ No newline at end of file
+        print(f"\nAn error occurred: {e}")
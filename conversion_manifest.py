@@ -0,0 +1,162 @@
+import json
+import os
+from typing import Dict, Optional, Tuple
+from dedupe import data_hash, full_hash
+
+MANIFEST_NAME = '.conversion_manifest.jsonl'
+# Outputs are written under this suffix and renamed into place when complete
+PART_SUFFIX = '.part'
+# Manifest records are fsynced in batches; each output is already durable when recorded
+SYNC_EVERY = 64
+
+def source_identity(path, data: Optional[bytes] = None,
+                    stat_result: Optional[os.stat_result] = None) -> Dict:
+    """Size, mtime and content hash of a source file, as recorded in the manifest.
+
+    Pass the file's bytes as data when they have been read already, so the
+    hash does not read the file a second time, together with the stat taken
+    before that read.
+    """
+    st = stat_result if stat_result is not None else os.stat(path)
+    content_hash = data_hash(data) if data is not None else full_hash(path)
+    return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'hash': content_hash}
+
+def fsync_directory(folder) -> None:
+    """Make renames and new entries in folder durable. A no-op where directories cannot be opened (Windows)."""
+    if not hasattr(os, 'O_DIRECTORY'):
+        return
+    fd = os.open(folder, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def write_atomic(path, data) -> None:
+    """Write data to a temporary file next to path, fsync it, then rename it over path.
+
+    The data is on disk before the rename and the rename before this
+    returns, so a crash leaves at most a stray .part file, never a
+    truncated output under the final name, and whatever is recorded as
+    written afterwards (e.g. a manifest line) really is.
+    """
+    part = f"{path}{PART_SUFFIX}"
+    try:
+        with open(part, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(part, path)
+        fsync_directory(os.path.dirname(os.path.abspath(path)))
+    except BaseException:
+        try:
+            os.remove(part)
+        except OSError:
+            pass
+        raise
+
+def remove_partial_outputs(folder) -> int:
+    """Delete .part files left behind by interrupted runs."""
+    removed = 0
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.name.endswith(PART_SUFFIX) and entry.is_file():
+                try:
+                    os.remove(entry.path)
+                    removed += 1
+                except OSError as e:
+                    print(f"Could not remove {entry.name}: {e}")
+    return removed
+
+class ConversionManifest:
+    """Append-only journal of a conversion run, kept in the output folder.
+
+    One JSON line per finished source: its identity, output path, the
+    settings used and the status. Records are kept per source and settings,
+    so runs with another backend or other settings into the same folder do
+    not hide each other; for each pair the last line wins. A 'done' line
+    also drops the records of other settings whose output it overwrote. All
+    of them are loaded into a dict on open, so checking whether a source is
+    already done costs a lookup and the stat the caller already has. A line
+    cut short by a crash is ignored.
+    """
+
+    def __init__(self, folder):
+        self.path = os.path.join(folder, MANIFEST_NAME)
+        self.records: Dict[Tuple[str, str], Dict] = {}
+        # Key of the last 'done' record for each output path
+        self._done_by_output: Dict[str, Tuple[str, str]] = {}
+        if os.path.exists(self.path):
+            with open(self.path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    self._apply(record)
+        self._file = open(self.path, 'a', encoding='utf-8')
+        self._unsynced = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @staticmethod
+    def _key(source, settings: Dict) -> Tuple[str, str]:
+        return source, json.dumps(settings, sort_keys=True)
+
+    def _apply(self, record: Dict) -> None:
+        key = self._key(record['source'], record['settings'])
+        if record['status'] == 'done':
+            # The output now holds this conversion, whatever another one recorded for it
+            previous = self._done_by_output.get(record['output'])
+            if previous is not None and previous != key and self.records.get(previous, {}).get('output') == record['output']:
+                del self.records[previous]
+            self._done_by_output[record['output']] = key
+        self.records[key] = record
+
+    def completed(self, source, settings: Dict, stat_result: Optional[os.stat_result] = None) -> Optional[str]:
+        """Output path if source was converted with these settings and has not changed since, else None.
+
+        A source whose mtime changed but whose size did not (e.g. copied to
+        new storage) is hashed and still counts as done if its content is
+        the same.
+        """
+        record = self.records.get(self._key(os.path.abspath(source), settings))
+        if record is None or record['status'] != 'done':
+            return None
+        st = stat_result if stat_result is not None else os.stat(source)
+        if record['size'] != st.st_size:
+            return None
+        if record['mtime_ns'] != st.st_mtime_ns and record.get('hash') != full_hash(source):
+            return None
+        return record['output']
+
+    def record(self, source, identity: Dict, output, settings: Dict, status: str = 'done',
+               error: Optional[str] = None) -> None:
+        """Append the outcome for one source. identity comes from source_identity at read time."""
+        record = {'source': os.path.abspath(source), **identity, 'output': os.path.abspath(output),
+                  'settings': settings, 'status': status}
+        if error is not None:
+            record['error'] = error
+        self._apply(record)
+        self._file.write(json.dumps(record) + '\n')
+        self._file.flush()
+        self._unsynced += 1
+        if self._unsynced >= SYNC_EVERY:
+            self.sync()
+
+    def sync(self) -> None:
+        """Flush the manifest to disk.
+
+        Outputs go through write_atomic, which has them on disk before they
+        are recorded, so a 'done' line never outlives its output.
+        """
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+
+    def close(self) -> None:
+        self.sync()
+        self._file.close()
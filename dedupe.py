@@ -0,0 +1,209 @@
+import hashlib
+import mmap
+import os
+import stat
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterable, List, Tuple
+from media_cache import MediaCache
+
+try:
+    import blake3
+    HASH_NAME = 'blake3'
+    new_hasher = blake3.blake3
+except ImportError:
+    try:
+        import xxhash
+        HASH_NAME = 'xxh3_128'
+        new_hasher = xxhash.xxh3_128
+    except ImportError:
+        HASH_NAME = 'blake2b'
+        new_hasher = hashlib.blake2b
+
+# Bytes hashed from each end of a file in the partial-hash stage
+PARTIAL_BYTES = 16 * 1024
+# Full hashes feed the mapped file to the hasher in slices of this size
+HASH_CHUNK = 16 << 20
+HASH_WORKERS = min(16, (os.cpu_count() or 1) * 2)
+ACTIONS = ('skip', 'delete', 'hardlink')
+
+def partial_hash(path) -> str:
+    """Hash of the size plus the first and last PARTIAL_BYTES of a file."""
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        hasher = new_hasher()
+        hasher.update(size.to_bytes(8, 'little'))
+        hasher.update(f.read(PARTIAL_BYTES))
+        if size > PARTIAL_BYTES:
+            f.seek(max(PARTIAL_BYTES, size - PARTIAL_BYTES))
+            hasher.update(f.read(PARTIAL_BYTES))
+    return hasher.hexdigest()
+
+def data_hash(data) -> str:
+    """full_hash of bytes already in memory, for callers that have read the file anyway."""
+    hasher = new_hasher()
+    hasher.update(data)
+    return f"{HASH_NAME}:{hasher.hexdigest()}"
+
+def full_hash(path) -> str:
+    """Hash of the whole file, read through a memory map. Prefixed with the algorithm name."""
+    hasher = new_hasher()
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                view = memoryview(data)
+                try:
+                    for offset in range(0, len(data), HASH_CHUNK):
+                        hasher.update(view[offset:offset + HASH_CHUNK])
+                finally:
+                    view.release()
+    return f"{HASH_NAME}:{hasher.hexdigest()}"
+
+def _group_by(paths: List[Path], key_func, executor) -> List[List[Path]]:
+    groups = defaultdict(list)
+    for path, key in zip(paths, executor.map(_safe(key_func), paths)):
+        if key is not None:
+            groups[key].append(path)
+    return [group for group in groups.values() if len(group) > 1]
+
+def _safe(func):
+    def wrapper(path):
+        try:
+            return func(path)
+        except OSError as e:
+            print(f"Error reading {path}: {e}")
+            return None
+    return wrapper
+
+def find_duplicates(files: Iterable[Tuple[Path, int]], cache=None) -> List[List[Path]]:
+    """Groups of byte-identical files from (path, size) pairs.
+
+    Groups keep the input order, so the first path of each group (the one
+    to keep) is the one listed first.
+
+    Runs in three stages so most files are never read in full: bucket by
+    size, hash the first/last few KB of same-size files, then fully hash
+    only what still collides. Full hashes are stored in the media cache
+    (content_hash) when one is given, so unchanged files are not re-read.
+    Empty files and symlinks are ignored: a link and its target are the
+    same data, not two copies of it.
+    """
+    by_size = defaultdict(list)
+    for path, size in files:
+        if size and not os.path.islink(path):
+            by_size[size].append(Path(path))
+
+    duplicates = []
+    with ThreadPoolExecutor(max_workers=HASH_WORKERS) as executor:
+        candidates = [(size, group) for size, group in by_size.items() if len(group) > 1]
+        for size, size_group in candidates:
+            for partial_group in _group_by(size_group, partial_hash, executor):
+                # The size from the first pass, not a new stat that fails if the file has gone since
+                if size <= 2 * PARTIAL_BYTES:
+                    # The partial hash already covered every byte
+                    duplicates.append(partial_group)
+                    continue
+                hashes = {}
+                if cache is not None:
+                    for path in partial_group:
+                        cached = cache.get(path)
+                        if cached and (cached['content_hash'] or '').startswith(HASH_NAME + ':'):
+                            hashes[path] = cached['content_hash']
+                missing = [path for path in partial_group if path not in hashes]
+                for path, digest in zip(missing, executor.map(_safe(full_hash), missing)):
+                    if digest is not None:
+                        hashes[path] = digest
+                        if cache is not None:
+                            cache.put(path, content_hash=digest)
+                groups = defaultdict(list)
+                for path in partial_group:
+                    if path in hashes:
+                        groups[hashes[path]].append(path)
+                duplicates.extend(group for group in groups.values() if len(group) > 1)
+    return duplicates
+
+def unique_files(paths: Iterable, cache=None) -> List[Path]:
+    """The given files minus every duplicate except the first of each group, in the original order."""
+    paths = [Path(p) for p in paths]
+    groups = find_duplicates(((p, p.stat().st_size) for p in paths), cache)
+    redundant = {path for group in groups for path in group[1:]}
+    return [p for p in paths if p not in redundant]
+
+def replace_with_hardlink(keeper: Path, duplicate: Path) -> None:
+    """Atomically swap duplicate for a hard link to keeper."""
+    temp = duplicate.with_name(f".{duplicate.name}.dedupe")
+    os.link(keeper, temp)
+    os.replace(temp, duplicate)
+
+def apply_action(groups: List[List[Path]], action: str) -> Tuple[int, int]:
+    """Skip, delete or hardlink every duplicate. Returns (files handled, bytes reclaimed).
+
+    A duplicate that is a symlink or already the same file as its keeper
+    (a hard link to it) is left alone: removing it would free nothing, or
+    remove the only copy. Bytes only count as reclaimed when the duplicate
+    was the last link to its data.
+    """
+    handled = reclaimed = 0
+    for keeper, *duplicates in groups:
+        for duplicate in duplicates:
+            try:
+                st = duplicate.lstat()
+                if action != 'skip' and (duplicate.is_symlink() or os.path.samefile(keeper, duplicate)):
+                    continue
+                if action == 'delete':
+                    duplicate.unlink()
+                elif action == 'hardlink':
+                    replace_with_hardlink(keeper, duplicate)
+                handled += 1
+                if action != 'skip' and st.st_nlink == 1:
+                    reclaimed += st.st_size
+            except OSError as e:
+                print(f"Error handling {duplicate}: {e}")
+    return handled, reclaimed
+
+def main():
+    folder = Path(input("Enter the folder to scan for duplicates: ").strip()).expanduser()
+    if not folder.is_dir():
+        print("Error: Invalid folder path")
+        return
+    action = input("Duplicates: skip (report only), delete or hardlink? (press Enter for skip): ").strip().lower() or 'skip'
+    if action not in ACTIONS:
+        print(f"Error: action must be one of {', '.join(ACTIONS)}")
+        return
+
+    files = []
+    for root, _, names in os.walk(folder):
+        for name in names:
+            path = Path(root) / name
+            try:
+                st = path.lstat()
+                # Symlinks point at data that is already counted (or outside the folder)
+                if stat.S_ISREG(st.st_mode):
+                    files.append((path, st.st_size))
+            except OSError as e:
+                print(f"Error reading {path}: {e}")
+    print(f"Scanning {len(files)} files ({HASH_NAME})...")
+
+    with MediaCache() as cache:
+        groups = find_duplicates(files, cache)
+    redundant = sum(len(group) - 1 for group in groups)
+    if not redundant:
+        print("No duplicates found.")
+        return
+    for keeper, *duplicates in groups:
+        print(f"- {keeper}")
+        for duplicate in duplicates:
+            print(f"    = {duplicate}")
+    print(f"\n{redundant} duplicate files in {len(groups)} groups.")
+
+    if action == 'skip':
+        return
+    if input(f"Do you want to {action} these duplicates? (y/n): ").strip().lower() != 'y':
+        print("Operation cancelled.")
+        return
+    handled, reclaimed = apply_action(groups, action)
+    print(f"{handled} duplicates handled, {reclaimed / (1024 * 1024):.1f} MB reclaimed.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+import abc
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+import numpy as np
+import imagecodecs
+from imagecodecs import imread
+from back_empty_cull import peak_memory_bytes
+from jxl_exe import encode_pixels_with_exe, find_cjxl
+from jxl_format import find_images, smart_convert_to_24bit
+from jxl_pipeline import run_pipeline
+from media_cache import DEFAULT_CACHE_PATH
+
+# The backend picked by the last bench run is remembered here
+DEFAULT_CHOICE_PATH = os.path.join(os.path.dirname(DEFAULT_CACHE_PATH), 'encoder_backend.json')
+FALLBACK_BACKEND = 'jxl'
+BENCH_SAMPLE = 20
+# A configuration is only picked if its mean PSNR is within this many dB of
+# the best one, and among those, if its output is within this fraction of
+# the smallest; the fastest of what is left wins
+PSNR_TOLERANCE = 1.0
+SIZE_TOLERANCE = 0.10
+
+
+class EncoderBackend(abc.ABC):
+    """One way of encoding a decoded image: name, output extension and encode().
+
+    Settings are passed to the encoder as keyword arguments and default to
+    the class's DEFAULTS. encode() takes the 8-bit (or 16-bit) gray or RGB
+    array produced by smart_convert_to_24bit. Backends with embeds_icc
+    also take the source's ICC profile as encode(..., icc=profile).
+    """
+    name = ''
+    extension = ''
+    embeds_icc = False
+    DEFAULTS: Dict = {}
+    # Settings tried by the bench command, each on top of DEFAULTS
+    BENCH_SETTINGS: List[Dict] = [{}]
+
+    def __init__(self, **settings):
+        self.settings = {**self.DEFAULTS, **settings}
+
+    @property
+    def label(self) -> str:
+        return ' '.join([self.name] + [f"{key}={value}" for key, value in self.settings.items()])
+
+    @abc.abstractmethod
+    def available(self) -> bool:
+        """Whether the encoder can be used on this machine."""
+
+    @abc.abstractmethod
+    def encode(self, img_arr: np.ndarray, numthreads: int) -> bytes:
+        """Encoded bytes of img_arr, using up to numthreads threads."""
+
+    def decode(self, data: bytes) -> np.ndarray:
+        return imagecodecs.imread(data)
+
+class JxlBackend(EncoderBackend):
+    """JPEG XL through imagecodecs (libjxl in process)."""
+    name = 'jxl'
+    extension = '.jxl'
+    DEFAULTS = {'level': 50, 'effort': 5}
+    BENCH_SETTINGS = [{'effort': 3}, {'effort': 5}, {'effort': 7}]
+
+    def available(self) -> bool:
+        return imagecodecs.JPEGXL.available
+
+    def encode(self, img_arr, numthreads):
+        return imagecodecs.jpegxl_encode(img_arr, numthreads=numthreads, **self.settings)
+
+class CjxlBackend(EncoderBackend):
+    """JPEG XL through the cjxl binary, fed an uncompressed PNM (or a PNG carrying the ICC profile)."""
+    name = 'cjxl'
+    extension = '.jxl'
+    DEFAULTS = {'quality': 50, 'effort': 5}
+    BENCH_SETTINGS = [{'effort': 5}, {'effort': 7}]
+    embeds_icc = True
+
+    def available(self) -> bool:
+        try:
+            find_cjxl()
+            return True
+        except FileNotFoundError:
+            return False
+
+    def encode(self, img_arr, numthreads, icc=None):
+        return encode_pixels_with_exe(img_arr, [f"--{key}={value}" for key, value in self.settings.items()],
+                                      numthreads, icc)
+
+class AvifBackend(EncoderBackend):
+    """AVIF through imagecodecs (libavif)."""
+    name = 'avif'
+    extension = '.avif'
+    DEFAULTS = {'level': 50, 'speed': 7}
+    BENCH_SETTINGS = [{'speed': 6}, {'speed': 8}]
+
+    def available(self) -> bool:
+        return imagecodecs.AVIF.available
+
+    def encode(self, img_arr, numthreads):
+        return imagecodecs.avif_encode(img_arr, numthreads=numthreads, **self.settings)
+
+class WebpBackend(EncoderBackend):
+    """WebP through imagecodecs (libwebp). 8-bit only, at most 16383 px per side."""
+    name = 'webp'
+    extension = '.webp'
+    # imagecodecs encodes WebP losslessly unless told otherwise
+    DEFAULTS = {'level': 75, 'method': 4, 'lossless': False}
+    BENCH_SETTINGS = [{'method': 4}, {'method': 6}]
+
+    def available(self) -> bool:
+        return imagecodecs.WEBP.available
+
+    def encode(self, img_arr, numthreads):
+        if img_arr.dtype != np.uint8:
+            img_arr = smart_convert_to_24bit(img_arr)
+        return imagecodecs.webp_encode(img_arr, numthreads=numthreads, **self.settings)
+
+BACKENDS = {backend.name: backend for backend in (JxlBackend, CjxlBackend, AvifBackend, WebpBackend)}
+
+def create_backend(name: Optional[str] = None, **settings) -> EncoderBackend:
+    """Backend by name, or the default chosen by the last bench run (with its settings)."""
+    if not name:
+        name, settings = load_default_backend()
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown encoder backend '{name}' (choose from {', '.join(BACKENDS)})")
+    return BACKENDS[name](**settings)
+
+def load_default_backend(path: str = DEFAULT_CHOICE_PATH):
+    """(name, settings) saved by the bench command, or the in-process JXL encoder."""
+    try:
+        with open(path, encoding='utf-8') as f:
+            choice = json.load(f)
+        return choice['name'], choice['settings']
+    except (OSError, ValueError, KeyError):
+        return FALLBACK_BACKEND, {}
+
+def save_default_backend(backend: EncoderBackend, path: str = DEFAULT_CHOICE_PATH) -> None:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'name': backend.name, 'settings': backend.settings}, f)
+
+def psnr(original: np.ndarray, decoded: np.ndarray) -> float:
+    maxval = 65535.0 if original.dtype == np.uint16 else 255.0
+    if decoded.shape != original.shape:
+        decoded = decoded.reshape(original.shape)
+    mse = np.mean((original.astype(np.float64) - decoded.astype(np.float64)) ** 2)
+    return 100.0 if mse == 0 else 10 * np.log10(maxval ** 2 / mse)
+
+def bench_backend(name: str, settings: Dict, paths: List[str], cores: int) -> Dict:
+    """Convert paths with one backend configuration and measure it. Runs in a fresh process.
+
+    Images go through the same pipeline and core budget as the converters,
+    decode included, so images/s and peak RSS are what a real run sees.
+    Quality (PSNR against the decoded source) is measured after the clock
+    stops.
+    """
+    backend = create_backend(name, **settings)
+    encoded = {}
+
+    def decode(path):
+        return smart_convert_to_24bit(imread(path))
+
+    def encode(path, img_arr, numthreads):
+        return backend.encode(img_arr, numthreads)
+
+    def write(path, data):
+        encoded[path] = data
+
+    started = time.perf_counter()
+    errors = [error for _, error in run_pipeline(paths, decode, encode, write, cores) if error is not None]
+    elapsed = time.perf_counter() - started
+    peak_rss = peak_memory_bytes(include_children=True)
+    quality = []
+    for path, data in encoded.items():
+        try:
+            quality.append(psnr(decode(path), backend.decode(data)))
+        except Exception as e:
+            errors.append(e)
+    return {
+        'label': backend.label, 'name': name, 'settings': backend.settings,
+        'images': len(encoded), 'errors': [str(error).splitlines()[0] for error in errors[:3]],
+        'seconds': elapsed, 'images_per_second': len(encoded) / elapsed if elapsed else 0.0,
+        'input_bytes': sum(os.path.getsize(path) for path in encoded),
+        'output_bytes': sum(len(data) for data in encoded.values()),
+        'psnr': sum(quality) / len(quality) if quality else 0.0,
+        'peak_rss': peak_rss,
+    }
+
+def pick_default(results: List[Dict]) -> Optional[Dict]:
+    """Fastest configuration among those close to the best quality and the smallest output."""
+    complete = [r for r in results if r['images'] and not r['errors']]
+    if not complete:
+        return None
+    best_psnr = max(r['psnr'] for r in complete)
+    candidates = [r for r in complete if r['psnr'] >= best_psnr - PSNR_TOLERANCE]
+    smallest = min(r['output_bytes'] for r in candidates)
+    candidates = [r for r in candidates if r['output_bytes'] <= smallest * (1 + SIZE_TOLERANCE)]
+    return max(candidates, key=lambda r: r['images_per_second'])
+
+def bench(folder: str, sample_size: int = BENCH_SAMPLE, cores: Optional[int] = None,
+          backends: Optional[List[str]] = None) -> List[Dict]:
+    """Run every available backend configuration on a random sample of folder's images.
+
+    Each configuration runs in its own freshly spawned process, so its peak
+    RSS is not mixed up with the others'.
+    """
+    cores = cores or os.cpu_count() or 1
+    images = [os.path.join(folder, image) for image in find_images(folder)]
+    sample = random.Random(0).sample(images, min(sample_size, len(images)))
+    results = []
+    for name in backends or list(BACKENDS):
+        backend_class = BACKENDS[name]
+        if not backend_class().available():
+            print(f"{name}: not available, skipped")
+            continue
+        for settings in backend_class.BENCH_SETTINGS:
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+                try:
+                    result = executor.submit(bench_backend, name, settings, sample, cores).result()
+                except Exception as e:
+                    print(f"{backend_class(**settings).label}: failed ({str(e).splitlines()[0]})")
+                    continue
+            results.append(result)
+            print_result(result)
+    return results
+
+def print_result(result: Dict) -> None:
+    saved = result['input_bytes'] - result['output_bytes']
+    percent = 100 * saved / result['input_bytes'] if result['input_bytes'] else 0.0
+    peak = f"{result['peak_rss'] / (1024 * 1024):.0f} MB" if result['peak_rss'] else "n/a"
+    print(f"{result['label']:<40} {result['images_per_second']:7.2f} img/s  "
+          f"saved {saved / (1024 * 1024):8.1f} MB ({percent:5.1f}%)  PSNR {result['psnr']:5.1f} dB  peak RSS {peak}")
+    for error in result['errors']:
+        print(f"    error: {error}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Encoder backends for the image converters.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('list', help="show the backends and the current default")
+    bench_parser = commands.add_parser('bench', help="measure every backend on a sample of a folder and pick a default")
+    bench_parser.add_argument('folder')
+    bench_parser.add_argument('--sample', type=int, default=BENCH_SAMPLE, help="number of images to encode")
+    bench_parser.add_argument('--cores', type=int, default=os.cpu_count(), help="cores to use")
+    bench_parser.add_argument('--backends', nargs='+', choices=list(BACKENDS), help="only these backends")
+    args = parser.parse_args()
+
+    if args.command == 'list':
+        for name, backend_class in BACKENDS.items():
+            backend = backend_class()
+            print(f"{backend.label:<40} {'available' if backend.available() else 'not available'}")
+        print(f"Default: {create_backend().label}")
+        return
+
+    if not os.path.isdir(args.folder):
+        print("Directory does not exist.")
+        sys.exit(1)
+    results = bench(args.folder, args.sample, args.cores, args.backends)
+    choice = pick_default(results)
+    if choice is None:
+        print("No backend completed the sample; default unchanged.")
+        return
+    backend = create_backend(choice['name'], **choice['settings'])
+    save_default_backend(backend)
+    print(f"\nDefault backend: {backend.label} (saved to {DEFAULT_CHOICE_PATH})")
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,7 @@ import os
 from pathlib import Path
 from datetime import datetime
 import time
+from rename_plan import RenamePlanner, apply_plan, find_unfinished_journals, is_plan_file, resume_plan
 
 def rename_files():
     # Ask for target directory
@@ -22,6 +23,11 @@ def rename_files():
     if not prefix:
         prefix = 'iph'
     
+    # Finish a run that was interrupted before starting a new one
+    for journal in find_unfinished_journals(target_path):
+        if input(f"Found an interrupted rename run ({journal.name}). Resume it? (y/n): ").lower().startswith('y'):
+            print(f"Resumed: {resume_plan(journal)} files renamed")
+    
     # Counter for renamed files
     renamed_files = 0
     
@@ -35,8 +41,8 @@ def rename_files():
         # Get all files in the directory
         files = list(directory.rglob('*') if recursive else directory.glob('*'))
         
-        # Filter out directories
-        files = [f for f in files if f.is_file()]
+        # Filter out directories and rename journals
+        files = [f for f in files if f.is_file() and not is_plan_file(f)]
         
         print(f"\nFound {len(files)} files to process in {directory}")
         proceed = input("Proceed with renaming? (y/n): ").lower().startswith('y')
@@ -45,6 +51,8 @@ def rename_files():
             print("Operation cancelled by user")
             return
         
+        # Plan every rename in memory first; duplicates are resolved against one listing per folder
+        planner = RenamePlanner()
         for file_path in files:
             try:
                 # Get file modification timestamp
@@ -58,24 +66,21 @@ def rename_files():
                 original_name = file_path.stem
                 original_ext = file_path.suffix
                 
-                # Generate new filename
-                new_name = f"{prefix}__{date_str}__{original_name}{original_ext}"
-                new_path = file_path.parent / new_name
-                
-                # Handle duplicate filenames
-                counter = 1
-                while new_path.exists():
-                    new_name = f"{prefix}__{date_str}__{original_name}_{counter}{original_ext}"
-                    new_path = file_path.parent / new_name
-                    counter += 1
-                
-                # Rename the file
-                file_path.rename(new_path)
-                renamed_files += 1
-                print(f"Renamed: {file_path.name} -> {new_name}")
+                # Generate new filename, with a counter on duplicates
+                planner.add(file_path, lambda counter: (
+                    f"{prefix}__{date_str}__{original_name}{original_ext}" if counter == 0
+                    else f"{prefix}__{date_str}__{original_name}_{counter}{original_ext}"))
                 
             except Exception as e:
                 print(f"Error processing {file_path.name}: {e}")
+        
+        # Rename via temporary names, journaled so an interrupted run can be resumed or undone
+        def on_renamed(source, target):
+            print(f"Renamed: {source.name} -> {target.name}")
+        
+        renamed, journal = apply_plan(planner.entries, directory, on_renamed)
+        renamed_files += renamed
+        print(f"Journal saved to {journal.name} (run rename_plan.py to undo)")
     
     # Start processing
     try:
@@ -6,14 +6,81 @@ from PIL import Image
 import pillow_heif
 from PIL.ExifTags import TAGS
 import ffmpeg
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from media_cache import MediaCache
+from media_meta import read_capture_date
+from rename_plan import RenamePlanner, apply_plan, find_unfinished_journals, is_plan_file, resume_plan
 
 # Register HEIF format support
 pillow_heif.register_heif_opener()
 
-def get_media_date(file_path):
-    """Extract date from media file based on type"""
+# Default number of files whose metadata is read at the same time
+DEFAULT_CONCURRENCY = min(32, (os.cpu_count() or 1) * 4)
+
+def lookup_media_date(file_path, cache):
+    """Cached capture date: a datetime, '' if the file is known to have none, None if not cached"""
+    cached = cache.get(file_path)
+    if not cached or cached['capture_date'] is None:
+        return None
+    return datetime.fromisoformat(cached['capture_date']) if cached['capture_date'] else ''
+
+def finish_media_date(file_path, media_datetime, cache=None):
+    """Record a freshly read capture date in the cache and fall back to the modification time"""
+    if cache is not None:
+        # An empty string records "no embedded date" so the file is not parsed again
+        cache.put(file_path, capture_date=media_datetime.isoformat() if media_datetime else '')
+    if media_datetime:
+        return media_datetime
+
+    # Fallback to file modification time
+    return datetime.fromtimestamp(os.path.getmtime(file_path))
+
+def stream_media_dates(files, cache=None, concurrency=DEFAULT_CONCURRENCY):
+    """Yield (file_path, media_datetime, error) as metadata reads complete.
+    
+    Cache lookups and writes stay on the calling thread; only the actual reads
+    (header parsing, PIL fallback, ffprobe subprocesses) fan out over up to
+    `concurrency` threads, so slow storage no longer serializes the run.
+    """
+    files = iter(files)
+    in_flight = {}
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        while True:
+            # Keep a few reads queued per thread so none of them idles between results
+            for file_path in files:
+                cached = lookup_media_date(file_path, cache) if cache is not None else None
+                if cached is not None:
+                    try:
+                        yield file_path, finish_media_date(file_path, cached or None), None
+                    except OSError as e:
+                        yield file_path, None, e
+                    continue
+                in_flight[executor.submit(read_media_date, file_path)] = file_path
+                if len(in_flight) >= concurrency * 2:
+                    break
+            if not in_flight:
+                return
+            
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                file_path = in_flight.pop(future)
+                try:
+                    yield file_path, finish_media_date(file_path, future.result(), cache), None
+                except Exception as e:
+                    yield file_path, None, e
+
+def read_media_date(file_path):
+    """Read the embedded capture date of an image or video, or None if there is none"""
     extension = file_path.suffix.lower()
     
+    # Header-only parse first; PIL/HEIF decoding and ffprobe are the fallback
+    try:
+        media_datetime = read_capture_date(file_path)
+        if media_datetime:
+            return media_datetime
+    except OSError as e:
+        print(f"Metadata read error for {file_path.name}: {e}")
+    
     # Try to get EXIF date for images
     if extension in ['.jpg', '.jpeg', '.heic', '.png', '.tiff', '.bmp']:
         try:
@@ -43,8 +110,7 @@ def get_media_date(file_path):
         except Exception as e:
             print(f"Video metadata read error for {file_path.name}: {e}")
     
-    # Fallback to file modification time
-    return datetime.fromtimestamp(os.path.getmtime(file_path))
+    return None
 
 def rename_files():
     # Ask for target directory
@@ -65,12 +131,24 @@ def rename_files():
     if not prefix:
         prefix = 'iph'
     
+    # Finish a run that was interrupted before starting a new one
+    for journal in find_unfinished_journals(target_path):
+        if input(f"Found an interrupted rename run ({journal.name}). Resume it? (y/n): ").lower().startswith('y'):
+            print(f"Resumed: {resume_plan(journal)} files renamed")
+    
     # Counter for renamed files
     renamed_files = 0
     
     # Ask if user wants to process files recursively
     recursive = input("Process files in subfolders too? (y/n): ").lower().startswith('y')
     
+    # Ask how many files to read metadata from at once (higher helps on network storage)
+    try:
+        concurrency = int(input(f"Metadata reads in parallel (press Enter for {DEFAULT_CONCURRENCY}): ").strip() or DEFAULT_CONCURRENCY)
+    except ValueError:
+        concurrency = DEFAULT_CONCURRENCY
+    concurrency = max(1, concurrency)
+    
     # Supported file extensions
     SUPPORTED_EXTENSIONS = {'.jpg', '.jpeg', '.heic', '.png', '.tiff', '.bmp', 
                           '.mp4', '.mov', '.m4v', '.avi'}
@@ -83,7 +161,7 @@ def rename_files():
         files = list(directory.rglob('*') if recursive else directory.glob('*'))
         
         # Filter out directories and unsupported files
-        files = [f for f in files if f.is_file() and f.suffix.lower() in SUPPORTED_EXTENSIONS]
+        files = [f for f in files if f.is_file() and f.suffix.lower() in SUPPORTED_EXTENSIONS and not is_plan_file(f)]
         
         print(f"\nFound {len(files)} supported files to process in {directory}")
         proceed = input("Proceed with renaming? (y/n): ").lower().startswith('y')
@@ -92,11 +170,13 @@ def rename_files():
             print("Operation cancelled by user")
             return
         
-        for file_path in files:
+        # Metadata is read concurrently; results stream into a single in-memory rename plan
+        planner = RenamePlanner()
+        for file_path, media_datetime, error in stream_media_dates(files, cache, concurrency):
+            if error is not None:
+                print(f"Error processing {file_path.name}: {error}")
+                continue
             try:
-                # Get date from media file
-                media_datetime = get_media_date(file_path)
-                
                 # Format the datetime
                 date_str = media_datetime.strftime('%Y_%m_%d__%H_%M')
                 
@@ -104,26 +184,25 @@ def rename_files():
                 original_name = file_path.stem
                 original_ext = file_path.suffix
                 
-                # Generate new filename
-                new_name = f"{prefix}__{date_str}__{original_name}{original_ext}"
-                new_path = file_path.parent / new_name
-                
-                # Handle duplicate filenames
-                counter = 1
-                while new_path.exists():
-                    new_name = f"{prefix}__{date_str}__{original_name}_{counter}{original_ext}"
-                    new_path = file_path.parent / new_name
-                    counter += 1
-                
-                # Rename the file
-                file_path.rename(new_path)
-                renamed_files += 1
-                print(f"Renamed: {file_path.name} -> {new_name}")
+                # Generate new filename, with a counter on duplicates
+                planner.add(file_path, lambda counter: (
+                    f"{prefix}__{date_str}__{original_name}{original_ext}" if counter == 0
+                    else f"{prefix}__{date_str}__{original_name}_{counter}{original_ext}"))
                 
             except Exception as e:
                 print(f"Error processing {file_path.name}: {e}")
+        
+        # Rename via temporary names, journaled so an interrupted run can be resumed or undone
+        def on_renamed(source, target):
+            cache.move(source, target)
+            print(f"Renamed: {source.name} -> {target.name}")
+        
+        renamed, journal = apply_plan(planner.entries, directory, on_renamed)
+        renamed_files += renamed
+        print(f"Journal saved to {journal.name} (run rename_plan.py to undo)")
     
     # Start processing
+    cache = MediaCache()
     try:
         print(f"\nProcessing folder: {target_path}")
         process_directory(target_path)
@@ -132,6 +211,8 @@ def rename_files():
         print("\nOperation cancelled by user")
     except Exception as e:
         print(f"\nAn error occurred: {e}")
+    finally:
+        cache.close()
 
 if __name__ == "__main__":
     rename_files()
\ No newline at end of file
@@ -1,18 +1,55 @@
+import asyncio
 import subprocess
 import os
+import shutil
+import struct
+import tempfile
+import zlib
+from collections import deque
+from typing import List, Optional, Tuple
+import numpy as np
+import imagecodecs
+from conversion_manifest import PART_SUFFIX
 
+# Set to the cjxl executable to use a specific build; otherwise cjxl is looked up on PATH
+CJXL_ENV = 'CJXL_PATH'
+LEGACY_CJXL = os.path.join('jxl-x64-windows-static', 'cjxl.exe')
+# A cjxl run is killed after this many seconds and retried up to DEFAULT_RETRIES times
+DEFAULT_TIMEOUT = 600
+DEFAULT_RETRIES = 1
+# Concurrent cjxl processes; each gets cpu_count / pool threads
+DEFAULT_POOL = max(1, (os.cpu_count() or 1) // 2)
+# Lines of stderr kept to explain a failure
+STDERR_TAIL = 5
 
-def compress_with_exe(input_file, output_file, quality=50):
+
+def find_cjxl():
+    """Path of the cjxl executable: CJXL_PATH, then PATH, then the bundled Windows build."""
+    configured = os.environ.get(CJXL_ENV)
+    if configured:
+        return configured
+    found = shutil.which('cjxl')
+    if found:
+        return found
+    for base in (os.getcwd(), os.path.dirname(os.path.abspath(__file__))):
+        legacy = os.path.join(base, LEGACY_CJXL)
+        if os.path.isfile(legacy):
+            return legacy
+    raise FileNotFoundError(f"cjxl not found: put it on PATH or set {CJXL_ENV}")
+
+def cjxl_path():
     # Path to the executable
-    exe_path = os.path.join(os.getcwd(), 'jxl-x64-windows-static', 'cjxl.exe')
+    return find_cjxl()
+
+def compress_with_exe(input_file, output_file, quality=50):
     num_threads = os.cpu_count()
 
     # Run the executable with input, output, and quality parameter
     try:
         result = subprocess.run(
-            [exe_path, 
-            input_file, 
-            output_file, 
+            [cjxl_path(),
+            input_file,
+            output_file,
             '--quality', str(quality),
             '--effort', str(5),
             '--num_threads', str(num_threads)
@@ -21,21 +58,154 @@ def compress_with_exe(input_file, output_file, quality=50):
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE
         )
-        
+
         # Print the output of the command
         print(result.stdout.decode())
     except subprocess.CalledProcessError as e:
-        print(f"An error occurred while running cjxl.exe: {e.stderr.decode()}")
+        print(f"An error occurred while running cjxl: {e.stderr.decode()}")
     except FileNotFoundError:
-        print("cjxl.exe not found. Please check the path and try again.")
+        print("cjxl not found. Please check the path and try again.")
 
+def transcode_jpeg_with_exe(jpeg_data, num_threads=None):
+    """Losslessly repack JPEG bytes as JPEG XL with cjxl and return the result.
 
-# compress_with_exe('111.png', '111.jxl', 50)
-        
+    The DCT coefficients are kept as they are, so the original JPEG can be
+    rebuilt bit for bit. Raises on failure instead of printing, so callers
+    can fall back to re-encoding the pixels.
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        input_file = os.path.join(temp_dir, 'input.jpg')
+        output_file = os.path.join(temp_dir, 'output.jxl')
+        with open(input_file, 'wb') as f:
+            f.write(jpeg_data)
+        try:
+            subprocess.run(
+                [cjxl_path(), input_file, output_file,
+                 '--lossless_jpeg=1',
+                 '--effort', str(5),
+                 '--num_threads', str(num_threads or os.cpu_count())],
+                check=True,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                timeout=DEFAULT_TIMEOUT
+            )
+        except subprocess.CalledProcessError as e:
+            raise RuntimeError(f"cjxl failed: {e.stderr.decode(errors='replace').strip()}") from e
+        with open(output_file, 'rb') as f:
+            return f.read()
+
+def png_with_icc(img_arr, icc: bytes) -> bytes:
+    """PNG of a gray or RGB array with the ICC profile in an iCCP chunk, right after IHDR."""
+    png = imagecodecs.png_encode(img_arr)
+    payload = b'ICC Profile\0\0' + zlib.compress(icc)
+    chunk = struct.pack('>I', len(payload)) + b'iCCP' + payload
+    chunk += struct.pack('>I', zlib.crc32(b'iCCP' + payload))
+    # Signature (8 bytes) plus the IHDR chunk (25 bytes)
+    return png[:33] + chunk + png[33:]
+
+def encode_pixels_with_exe(img_arr, options: List[str], num_threads=None, icc: Optional[bytes] = None) -> bytes:
+    """Encode a gray or RGB array (8 or 16 bit) with cjxl and return the JPEG XL bytes.
+
+    The pixels go in as an uncompressed PNM, or as a PNG when there is an
+    ICC profile to embed, since cjxl only takes the colour space from the
+    input file. options are extra cjxl arguments, e.g. ['--quality=50'].
+    """
+    if img_arr.ndim == 2 or img_arr.shape[2] == 1:
+        magic = 'P5'
+    elif img_arr.shape[2] == 3:
+        magic = 'P6'
+    else:
+        raise ValueError(f"cjxl takes gray or RGB images, not {img_arr.shape[2]} channels")
+    maxval = 65535 if img_arr.dtype == np.uint16 else 255
+    with tempfile.TemporaryDirectory() as temp_dir:
+        input_file = os.path.join(temp_dir, 'input.png' if icc else 'input.pnm')
+        output_file = os.path.join(temp_dir, 'output.jxl')
+        with open(input_file, 'wb') as f:
+            if icc:
+                f.write(png_with_icc(img_arr, icc))
+            else:
+                f.write(f"{magic}\n{img_arr.shape[1]} {img_arr.shape[0]}\n{maxval}\n".encode())
+                f.write(np.ascontiguousarray(img_arr, dtype='>u2' if maxval > 255 else np.uint8).tobytes())
+        args = [find_cjxl(), input_file, output_file, '--num_threads', str(num_threads or os.cpu_count()), *options]
+        result = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=DEFAULT_TIMEOUT)
+        if result.returncode != 0:
+            raise RuntimeError(f"cjxl failed: {result.stderr.decode(errors='replace').strip()}")
+        with open(output_file, 'rb') as f:
+            return f.read()
+
+async def run_cjxl(args: List[str], label: str, timeout: float = DEFAULT_TIMEOUT,
+                   retries: int = DEFAULT_RETRIES, verbose: bool = False) -> None:
+    """Run cjxl with args, streaming its stderr as it arrives, killed after timeout and retried on failure."""
+    exe_path = find_cjxl()
+    error = None
+    for attempt in range(1, retries + 2):
+        process = await asyncio.create_subprocess_exec(
+            exe_path, *args, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE)
+        tail = deque(maxlen=STDERR_TAIL)
 
-input_folder = input("Input folder: ")
-output_folder = input_folder + '_compressed'
-os.makedirs(output_folder, exist_ok=True)
+        async def follow():
+            async for raw_line in process.stderr:
+                line = raw_line.decode(errors='replace').rstrip()
+                if line:
+                    tail.append(line)
+                    if verbose:
+                        print(f"[{label}] {line}")
+            return await process.wait()
+
+        try:
+            returncode = await asyncio.wait_for(follow(), timeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            error = f"timed out after {timeout}s"
+        else:
+            if returncode == 0:
+                return
+            error = f"exit code {returncode}: {' | '.join(tail)}"
+        if attempt <= retries:
+            print(f"[{label}] attempt {attempt} failed ({error}), retrying")
+    raise RuntimeError(error)
+
+async def compress_many(jobs: List[Tuple[str, str]], pool_size: int = DEFAULT_POOL, quality: int = 50,
+                        timeout: float = DEFAULT_TIMEOUT, retries: int = DEFAULT_RETRIES,
+                        verbose: bool = False) -> List[Tuple[str, Optional[Exception]]]:
+    """Encode (input, output) pairs with at most pool_size cjxl processes at a time.
+
+    Each process gets an equal share of the cores as threads, so the pool
+    as a whole never runs more threads than there are cores. Outputs are
+    written under a .part name and renamed into place once cjxl succeeds.
+    Returns (input, error or None) per job, in completion order.
+    """
+    num_threads = max(1, (os.cpu_count() or 1) // pool_size)
+    slots = asyncio.Semaphore(pool_size)
+    results = []
+
+    async def one(input_file, output_file):
+        part = output_file + PART_SUFFIX
+        async with slots:
+            try:
+                await run_cjxl([input_file, part,
+                                '--quality', str(quality),
+                                '--effort', str(5),
+                                '--num_threads', str(num_threads)],
+                               os.path.basename(input_file), timeout, retries, verbose)
+                os.replace(part, output_file)
+                error = None
+            except Exception as e:
+                if os.path.exists(part):
+                    os.remove(part)
+                error = e
+        results.append((input_file, error))
+        if error is None:
+            print(f"{len(results)}/{len(jobs)} --- {os.path.basename(input_file)}")
+        else:
+            print(f"{len(results)}/{len(jobs)} --- Error compressing {os.path.basename(input_file)}: {error}")
+
+    await asyncio.gather(*(one(input_file, output_file) for input_file, output_file in jobs))
+    return results
+
+
+# compress_with_exe('111.png', '111.jxl', 50)
 
 def is_image(filename):
     IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff'}
@@ -44,12 +214,25 @@ def is_image(filename):
 def find_images(folder):
     return [f for f in os.listdir(folder) if is_image(f)]
 
+def main():
+    try:
+        print(f"Using {find_cjxl()}")
+    except FileNotFoundError as e:
+        print(e)
+        return
+
+    input_folder = input("Input folder: ")
+    output_folder = input_folder + '_compressed'
+    os.makedirs(output_folder, exist_ok=True)
+    pool_size = int(input(f"Concurrent cjxl processes (default {DEFAULT_POOL}): ") or DEFAULT_POOL)
+    timeout = float(input(f"Timeout per image in seconds (default {DEFAULT_TIMEOUT}): ") or DEFAULT_TIMEOUT)
+    verbose = input("Show cjxl output? (y/n, default n): ").strip().lower() == 'y'
 
-image_list = find_images(input_folder)
-stats_current = 0
-stats_max = len(image_list)
+    image_list = find_images(input_folder)
+    jobs = [(os.path.join(input_folder, image), os.path.join(output_folder, f"{image}.jxl")) for image in image_list]
+    results = asyncio.run(compress_many(jobs, pool_size, timeout=timeout, verbose=verbose))
+    failed = sum(1 for _, error in results if error is not None)
+    print(f"Done: {len(results) - failed} converted, {failed} failed.")
 
-for image in image_list:
-    stats_current += 1
-    print(f"{image} --- {stats_current}/{stats_max}")
-    compress_with_exe(os.path.join(input_folder, image), os.path.join(output_folder, image))
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -1,60 +1,22 @@
 from imagecodecs import JPEGXL, jpegxl_encode, avif_encode, imread
+import argparse
 import os
 import platform
-from datetime import datetime, timezone
+from datetime import datetime
 import shutil
 import pytz
-import ctypes
 import numpy as np
+from media_cache import MediaCache
+from dedupe import unique_files
+from adaptive_quality import adaptive_distance
+from conversion_manifest import ConversionManifest, remove_partial_outputs, source_identity, write_atomic
+from jxl_exe import encode_pixels_with_exe, find_cjxl
+from jxl_pipeline import JpegSource, jpeg_source, run_pipeline, transcode_jpeg
+from media_meta import embedded_metadata
+from metadata_carry import add_jxl_metadata, apply_file_times
 
-
-def set_file_times(filepath: str, create_time: datetime, modify_time: datetime):
-    # Ensure datetime objects are naive and in UTC
-    if create_time.tzinfo is not None:
-        create_time = create_time.astimezone(timezone.utc).replace(tzinfo=None)
-    if modify_time.tzinfo is not None:
-        modify_time = modify_time.astimezone(timezone.utc).replace(tzinfo=None)
-
-    # Convert datetime objects to FILETIME format
-    def datetime_to_filetime(dt: datetime) -> (int, int):
-        # FILETIME structure: 64-bit integer (high and low 32-bit)
-        windows_epoch = datetime(1601, 1, 1)
-        delta = dt - windows_epoch
-        # Convert to 100-nanosecond intervals
-        total_100ns_intervals = int(delta.total_seconds() * 10**7)
-        low = total_100ns_intervals & 0xFFFFFFFF
-        high = (total_100ns_intervals >> 32) & 0xFFFFFFFF
-        return low, high
-
-    # Convert datetimes to FILETIME format
-    create_time_low, create_time_high = datetime_to_filetime(create_time)
-    modify_time_low, modify_time_high = datetime_to_filetime(modify_time)
-
-    # Define FILETIME structure
-    class FILETIME(ctypes.Structure):
-        _fields_ = [("dwLowDateTime", ctypes.c_uint32),
-                    ("dwHighDateTime", ctypes.c_uint32)]
-
-    # Prepare FILETIME structures
-    create_time_filetime = FILETIME(dwLowDateTime=create_time_low, dwHighDateTime=create_time_high)
-    modify_time_filetime = FILETIME(dwLowDateTime=modify_time_low, dwHighDateTime=modify_time_high)
-
-    # Load Windows API functions
-    kernel32 = ctypes.windll.kernel32
-    handle = kernel32.CreateFileW(filepath, 0x40000000, 0, None, 3, 0, None)  # GENERIC_WRITE
-
-    if handle == -1:
-        raise FileNotFoundError("The file could not be opened")
-
-    # Set file times
-    success = kernel32.SetFileTime(handle, ctypes.byref(create_time_filetime), None, ctypes.byref(modify_time_filetime))
-    
-    if not success:
-        raise OSError("Failed to set file times")
-
-    # Close the handle
-    kernel32.CloseHandle(handle)
-
+# smart_convert_to_24bit converts this many bytes of rows at a time
+CONVERT_TILE_BYTES = 8 << 20
 
 
 def is_image(filename):
@@ -71,40 +33,72 @@ def find_images(folder):
     
 #     return compressed_arr
 
-def smart_convert_to_24bit(img_arr):
-    # Check if we need to convert (if it's higher than 8-bit)
-    if img_arr.dtype in (np.uint16, np.float32, np.float64):
-        # Normalize to 0-1 range from 16-bit
-        img_float = img_arr.astype(np.float32) / np.iinfo(np.uint16).max
-        
-        # If image has alpha channel (4 channels), keep only RGB
-        if img_float.shape[-1] == 4:
-            img_float = img_float[..., :3]
-        
-        # Convert to 8-bit (0-255 range)
-        return (img_float * 255).clip(0, 255).astype(np.uint8)
-    
-    # If already 8-bit, just handle alpha if present
-    if img_arr.dtype == np.uint8 and img_arr.shape[-1] == 4:
-        return img_arr[..., :3]
-    
-    # If already 8-bit RGB, return as-is
-    return img_arr
-
-def get_compressed_image_data(file_path):
-    # Read the image
-    img_arr = imread(file_path)
-    
-    img_arr = smart_convert_to_24bit(img_arr)
-        # Standard 24-bit compression
-    compressed_arr = jpegxl_encode(
+def smart_convert_to_24bit(img_arr, keep_16bit=False):
+    """Reduce an image to what the encoder gets: 8 bits per channel, no alpha.
+
+    uint16 is rounded to 8 bits with integer math, float images are taken to
+    be in the nominal 0-1 range and scaled by 255, other integer types by
+    their own maximum. The conversion writes into one uint8 output a tile of
+    rows at a time, so memory use is the output plus one tile rather than
+    several float copies of the image. With keep_16bit, uint16 images are
+    passed through unchanged for the encoder to store at 16 bits.
+    """
+    # If image has alpha channel (4 channels), keep only RGB. A 2D image's
+    # last axis is its width, not channels.
+    if img_arr.ndim == 3 and img_arr.shape[-1] == 4:
+        img_arr = img_arr[..., :3]
+
+    # If already 8-bit RGB (or 16-bit is wanted), return as-is
+    if img_arr.dtype == np.uint8 or (keep_16bit and img_arr.dtype == np.uint16):
+        return img_arr
+
+    out = np.empty(img_arr.shape, dtype=np.uint8)
+    row_values = max(1, out[0].size)
+    rows = max(1, CONVERT_TILE_BYTES // (row_values * 8))
+    for start in range(0, img_arr.shape[0], rows):
+        tile = img_arr[start:start + rows]
+        if img_arr.dtype == np.uint16:
+            # round(x * 255 / 65535), exact for every 16-bit value
+            scratch = tile.astype(np.uint32)
+            scratch *= 255
+            scratch += 32895
+            scratch >>= 16
+        else:
+            # Floats (and bools) are nominally 0-1, other integers 0-max
+            scale = 255 / np.iinfo(img_arr.dtype).max if img_arr.dtype.kind in 'ui' else 255
+            scratch = tile.astype(np.float32 if img_arr.dtype.itemsize <= 4 else np.float64)
+            scratch *= scale
+            scratch += 0.5
+            np.nan_to_num(scratch, copy=False)
+            np.clip(scratch, 0, 255, out=scratch)
+        out[start:start + rows] = scratch
+    return out
+
+def encode_image(img_arr, numthreads=None, distance=None, icc=None):
+    # A butteraugli distance picked by the adaptive search, else standard 24-bit compression
+    if icc:
+        # jpegxl_encode cannot embed an ICC profile; cjxl takes it from a PNG input
+        options = [f"--distance={distance}"] if distance is not None else ["--quality=50"]
+        return encode_pixels_with_exe(img_arr, options + ["--effort=5"], numthreads or os.cpu_count(), icc)
+    if distance is not None:
+        return jpegxl_encode(img_arr, distance=distance, effort=5, numthreads=numthreads or os.cpu_count())
+    return jpegxl_encode(
         img_arr,
         level=50,
         effort=5,
-        numthreads=os.cpu_count()
+        numthreads=numthreads or os.cpu_count()
     )
-    
-    return compressed_arr
+
+def encode_payload(payload, numthreads=None, icc=None):
+    # JPEGs queued for transcoding keep their DCT coefficients; ones the
+    # transcoder rejects (e.g. CMYK) are re-encoded from pixels instead
+    if isinstance(payload, JpegSource):
+        try:
+            return transcode_jpeg(payload, numthreads or os.cpu_count())
+        except Exception as e:
+            print(f"Lossless JPEG transcode failed ({e}), re-encoding pixels")
+            payload = smart_convert_to_24bit(imread(payload.data))
+    return encode_image(payload, numthreads, icc=icc)
 
 def generate_new_file_name(original_file_path, gmt_offset=0):
 # function to generate a new file name based on the pattern
@@ -135,53 +129,160 @@ def generate_new_file_name(original_file_path, gmt_offset=0):
 
     return new_file_name, creation_datetime_local
 
-support = JPEGXL.available
-if not support:
-    raise RuntimeError("JXL is not available")
-
-target_folder = input("Target folder: ")
-utc_correction = int(input("UTC correction (default 0): ") or 0)
-
-if not os.path.isdir(target_folder):
-    print("Directory does not exist.")
-    exit(1)
-
-compress_folder = target_folder + '_compressed'
-os.makedirs(compress_folder, exist_ok=True)
-
-
-image_list = find_images(target_folder)
-stats_current = 0
-stats_max = len(image_list)
-
-# Iterate through each image in the list
-for image in image_list:
-    stats_current += 1
-    print(f"{stats_current}/{stats_max} --- {image}")
-
-    original_file_path = os.path.join(target_folder, image)
-
-    # Generate the new file name and path for the compressed image
-    new_file_name, creation_datetime = generate_new_file_name(original_file_path, gmt_offset=utc_correction)
-    new_file_name = new_file_name.strip().replace(' ', '_')
-
-    new_file_path = os.path.join(compress_folder, new_file_name)
-
-    # check if file exists
-    if os.path.exists(new_file_path):
-        print(f"File {new_file_name} already exists. Skipping.")
-        continue
-
-    # Compress the image and get the compressed data
-    image_data = get_compressed_image_data(original_file_path)
-
-    # Write the compressed image data to a new file
-    with open(new_file_path, 'wb') as f:
-        f.write(image_data)
-
-    # Copy the original file's metadata to the new compressed file
-    # shutil.copystat(original_file_path, new_file_path)
-    # set created and modified specifically with 'creation_datetime
-    set_file_times(new_file_path, creation_datetime, creation_datetime)
-
-print("Compression complete. Compressed files are saved with original metadata.")
\ No newline at end of file
+def main():
+    parser = argparse.ArgumentParser(description="Convert a folder of images to JPEG XL.")
+    parser.add_argument('--resume', action='store_true',
+                        help="skip sources the run manifest records as converted with the same settings")
+    parser.add_argument('--retry-failed', action='store_true',
+                        help="try again sources that failed to convert on a previous run")
+    args = parser.parse_args()
+
+    support = JPEGXL.available
+    if not support:
+        raise RuntimeError("JXL is not available")
+
+    target_folder = input("Target folder: ")
+    utc_correction = int(input("UTC correction (default 0): ") or 0)
+
+    if not os.path.isdir(target_folder):
+        print("Directory does not exist.")
+        exit(1)
+
+    compress_folder = target_folder + '_compressed'
+    os.makedirs(compress_folder, exist_ok=True)
+
+    skip_duplicates = input("Skip byte-identical duplicates? (y/n, default n): ").strip().lower() == 'y'
+    cores = int(input(f"CPU cores to use (default {os.cpu_count()}): ") or os.cpu_count())
+    # Repacks JPEG DCT coefficients: no pixel decode, no generational loss
+    transcode_jpegs = input("Losslessly transcode JPEGs instead of re-encoding? (y/n, default n): ").strip().lower() == 'y'
+    keep_16bit = input("Keep 16-bit sources at 16 bits? (y/n, default n): ").strip().lower() == 'y'
+    # Searches each image's quality so it lands near this size (e.g. 0.25 = 2 bits per pixel)
+    target_bpp = float(input("Target bytes per pixel (press Enter for fixed quality 50): ") or 0)
+
+    # Colour-managed sources keep their ICC profile through cjxl, where it is installed
+    try:
+        find_cjxl()
+        keep_icc = True
+    except FileNotFoundError:
+        print("cjxl not found: ICC profiles of PNG/TIFF sources will not be kept.")
+        keep_icc = False
+
+    settings = {'level': 50, 'effort': 5, 'transcode_jpegs': transcode_jpegs, 'keep_16bit': keep_16bit,
+                'utc_correction': utc_correction, 'target_bpp': target_bpp}
+    manifest = ConversionManifest(compress_folder)
+    removed = remove_partial_outputs(compress_folder)
+    if removed:
+        print(f"Removed {removed} partial outputs of an interrupted run.")
+
+    image_list = find_images(target_folder)
+    cache = MediaCache()
+    if skip_duplicates:
+        # Only the first copy of each identical file gets encoded
+        unique = unique_files((os.path.join(target_folder, image) for image in image_list), cache)
+        print(f"Skipping {len(image_list) - len(unique)} duplicate files.")
+        image_list = [path.name for path in unique]
+
+    jobs = []
+    already_done = 0
+    for image in image_list:
+        original_file_path = os.path.join(target_folder, image)
+
+        if args.resume and manifest.completed(original_file_path, settings):
+            already_done += 1
+            continue
+
+        # Generate the new file name and path for the compressed image
+        new_file_name, creation_datetime = generate_new_file_name(original_file_path, gmt_offset=utc_correction)
+        new_file_name = new_file_name.strip().replace(' ', '_')
+
+        new_file_path = os.path.join(compress_folder, new_file_name)
+
+        # check if file exists
+        if not args.resume and os.path.exists(new_file_path):
+            print(f"File {new_file_name} already exists. Skipping.")
+            continue
+
+        # Unchanged sources that failed before are not decoded again, unless asked to
+        cached = None if args.retry_failed else cache.get(original_file_path)
+        if cached and (cached['conversion_status'] or '').startswith('failed'):
+            print(f"File {image} failed to convert on a previous run ({cached['conversion_status']}). "
+                  "Skipping (use --retry-failed to try again).")
+            continue
+
+        jobs.append((original_file_path, new_file_path, creation_datetime))
+    if already_done:
+        print(f"Resuming: {already_done} files were already converted.")
+
+    # Worker threads only record image sizes, source identities and embedded
+    # metadata; the cache and manifest are written from this thread
+    decoded_info = {}
+    identities = {}
+    metadata = {}
+
+    def read(job):
+        # Stat taken before reading, so a source changed mid-run is converted again next time
+        st = os.stat(job[0])
+        with open(job[0], 'rb') as f:
+            data = f.read()
+        identities[job[0]] = source_identity(job[0], data, st)
+        return data
+
+    def decode(job, data):
+        metadata[job[0]] = embedded_metadata(data)
+        if transcode_jpegs:
+            source = jpeg_source(job[0], data)
+            if source is not None:
+                decoded_info[job[0]] = (source.width, source.height, 'uint8')
+                return source
+        img_arr = imread(data)
+        decoded_info[job[0]] = (img_arr.shape[1], img_arr.shape[0], str(img_arr.dtype))
+        return smart_convert_to_24bit(img_arr, keep_16bit)
+
+    def encode(job, payload, numthreads):
+        icc = metadata.get(job[0], {}).get('icc') if keep_icc else None
+        if target_bpp and not isinstance(payload, JpegSource):
+            # Searched once per content and target; reruns and copies reuse the result
+            distance = adaptive_distance(payload, target_bpp, identities[job[0]]['hash'], cache, numthreads)
+            image_data = encode_image(payload, numthreads, distance, icc)
+        else:
+            image_data = encode_payload(payload, numthreads, icc)
+        # Exif/XMP/ICC come from the bytes read for decoding, not a second open of the source
+        return add_jxl_metadata(image_data, metadata.pop(job[0], {}))
+
+    def write(job, image_data):
+        # Write the compressed image data to a new file
+        write_atomic(job[1], image_data)
+
+    def flush(written):
+        # set created and modified specifically with 'creation_datetime', once per writer batch
+        errors = apply_file_times((new_file_path, creation_datetime, creation_datetime)
+                                  for _, new_file_path, creation_datetime in written)
+        return {job: errors[job[1]] for job in written if job[1] in errors}
+
+    stats_current = 0
+    stats_max = len(jobs)
+    print(f"Converting {stats_max} images on {cores} cores...")
+    for job, error in run_pipeline(jobs, decode, encode, write, cores, read=read, flush=flush):
+        original_file_path, new_file_path, _ = job
+        stats_current += 1
+        if original_file_path in decoded_info:
+            width, height, dtype = decoded_info.pop(original_file_path)
+            cache.put(original_file_path, width=width, height=height, dtype=dtype)
+        identity = identities.pop(original_file_path, None)
+        metadata.pop(original_file_path, None)
+        if error is not None:
+            print(f"{stats_current}/{stats_max} --- Error compressing {os.path.basename(original_file_path)}: {error}")
+            cache.put(original_file_path, conversion_status=f"failed: {error}")
+            if identity is not None:
+                manifest.record(original_file_path, identity, new_file_path, settings, 'failed', str(error))
+            continue
+        print(f"{stats_current}/{stats_max} --- {os.path.basename(original_file_path)}")
+        cache.put(original_file_path, conversion_status=f"converted: {new_file_path}")
+        manifest.record(original_file_path, identity, new_file_path, settings)
+
+    manifest.close()
+    cache.close()
+    print("Compression complete. Compressed files are saved with original metadata.")
+
+if __name__ == "__main__":
+    main()
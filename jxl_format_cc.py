@@ -1,20 +1,14 @@
-from imagecodecs import JPEGXL, jpegxl_encode, imread
+from imagecodecs import imread
+import argparse
 import os
-import concurrent.futures
 import sys
-
-support = JPEGXL.available
-if not support:
-    raise RuntimeError("JXL is not available")
-
-target_folder = input("Target folder: ")
-
-if not os.path.isdir(target_folder):
-    print("Directory does not exist.")
-    exit(1)
-
-compress_folder = target_folder + '_compressed'
-os.makedirs(compress_folder, exist_ok=True)
+from datetime import datetime, timezone
+from conversion_manifest import ConversionManifest, remove_partial_outputs, source_identity, write_atomic
+from encoder_backends import BACKENDS, CjxlBackend, create_backend
+from jxl_format import smart_convert_to_24bit
+from jxl_pipeline import JpegSource, jpeg_source, run_pipeline, transcode_jpeg
+from media_meta import embedded_metadata
+from metadata_carry import add_jxl_metadata, apply_file_times
 
 def is_image(filename):
     IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff'}
@@ -23,36 +17,134 @@ def is_image(filename):
 def find_images(folder):
     return [f for f in os.listdir(folder) if is_image(f)]
 
-def process_file(filename):
-    img_path = os.path.join(target_folder, filename)
-    compressed_path = os.path.join(compress_folder, f"{filename}.jxl")
-    
-    img_arr = imread(img_path)
-    jxl_arr = jpegxl_encode(img_arr, level=50, effort=5, numthreads=os.cpu_count())
-    
-    with open(compressed_path, "wb") as f:
-        f.write(jxl_arr)
-
 def main():
+    parser = argparse.ArgumentParser(description="Convert a folder of images to JPEG XL (or another backend) in parallel.")
+    parser.add_argument('--resume', action='store_true',
+                        help="skip sources the run manifest records as converted with the same settings")
+    args = parser.parse_args()
+
+    # The default is whatever `encoder_backends.py bench` picked last, else JPEG XL
+    default_backend = create_backend()
+    backend_name = input(f"Encoder backend ({', '.join(BACKENDS)}; press Enter for {default_backend.label}): ").strip()
+    backend = create_backend(backend_name) if backend_name else default_backend
+    if not backend.available():
+        raise RuntimeError(f"{backend.name} is not available")
+
+    target_folder = input("Target folder: ")
+
+    if not os.path.isdir(target_folder):
+        print("Directory does not exist.")
+        sys.exit(1)
+
+    compress_folder = target_folder + '_compressed'
+    os.makedirs(compress_folder, exist_ok=True)
+
+    # Repacks JPEG DCT coefficients: no pixel decode, no generational loss
+    transcode_jpegs = backend.extension == '.jxl' and \
+        input("Losslessly transcode JPEGs instead of re-encoding? (y/n, default n): ").strip().lower() == 'y'
+
+    # imagecodecs cannot embed an ICC profile; sources that have one go through cjxl at the same quality
+    icc_backend = None
+    if backend.extension == '.jxl' and not backend.embeds_icc:
+        icc_backend = CjxlBackend(quality=backend.settings.get('level', 50), effort=backend.settings.get('effort', 5))
+        if not icc_backend.available():
+            print("cjxl not found: ICC profiles of PNG/TIFF sources will not be kept.")
+            icc_backend = None
+
+    settings = {'backend': backend.name, **backend.settings, 'transcode_jpegs': transcode_jpegs}
+    manifest = ConversionManifest(compress_folder)
+    removed = remove_partial_outputs(compress_folder)
+    if removed:
+        print(f"Removed {removed} partial outputs of an interrupted run.")
+
     image_list = find_images(target_folder)
+    if args.resume:
+        remaining = [f for f in image_list if not manifest.completed(os.path.join(target_folder, f), settings)]
+        print(f"Resuming: {len(image_list) - len(remaining)} files were already converted.")
+        image_list = remaining
     stats_max = len(image_list)
 
     if stats_max == 0:
         print("No images found to process.")
+        manifest.close()
         return
 
-    with concurrent.futures.ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
-        # Use map to apply process_file function to each filename
-        futures = {executor.submit(process_file, image): image for image in image_list}
-        
-        for future in concurrent.futures.as_completed(futures):
-            filename = futures[future]
+    # Identities are taken before each read, so a source changed mid-run is converted again next time
+    identities = {}
+    # Outputs keep the source's modification time and, for JPEG XL, its Exif, XMP and ICC profile
+    source_times = {}
+    metadata = {}
+
+    # Files are read on I/O threads ahead of the workers, so slow (network)
+    # storage overlaps with encoding instead of stalling a core per read
+    def read(filename):
+        img_path = os.path.join(target_folder, filename)
+        st = os.stat(img_path)
+        with open(img_path, 'rb') as f:
+            data = f.read()
+        identities[filename] = source_identity(img_path, data, st)
+        source_times[filename] = datetime.fromtimestamp(st.st_mtime_ns / 1e9, tz=timezone.utc)
+        return data
+
+    def decode(filename, data):
+        if backend.extension == '.jxl':
+            metadata[filename] = embedded_metadata(data)
+        if transcode_jpegs:
+            source = jpeg_source(filename, data)
+            if source is not None:
+                return source
+        # Backends take 8-bit gray or RGB without alpha, as in jxl_format
+        return smart_convert_to_24bit(imread(data))
+
+    def encode(filename, img_arr, numthreads):
+        encoded = None
+        if isinstance(img_arr, JpegSource):
             try:
-                future.result()  # To catch any exceptions raised during processing
-                stats_current = image_list.index(filename) + 1
-                print(f"{stats_current}/{stats_max} processed: {filename}")
+                encoded = transcode_jpeg(img_arr, numthreads)
             except Exception as e:
-                print(f"Error processing {filename}: {e}")
+                print(f"Lossless JPEG transcode of {filename} failed ({e}), re-encoding pixels")
+                img_arr = smart_convert_to_24bit(imread(img_arr.data))
+        if encoded is None:
+            icc = metadata.get(filename, {}).get('icc')
+            if icc and backend.embeds_icc:
+                encoded = backend.encode(img_arr, numthreads, icc=icc)
+            elif icc and icc_backend is not None:
+                encoded = icc_backend.encode(img_arr, numthreads, icc=icc)
+            else:
+                if icc:
+                    print(f"ICC profile of {filename} dropped: {backend.name} cannot embed it")
+                encoded = backend.encode(img_arr, numthreads)
+        # Exif/XMP (and ICC above) come from the bytes read for decoding, not a second open of the source
+        return add_jxl_metadata(encoded, metadata.pop(filename, {}))
+
+    def write(filename, encoded):
+        write_atomic(os.path.join(compress_folder, f"{filename}{backend.extension}"), encoded)
+
+    def flush(written):
+        # Timestamps are applied once per writer batch rather than after every write
+        paths = {filename: os.path.join(compress_folder, f"{filename}{backend.extension}") for filename in written}
+        errors = apply_file_times((paths[filename], source_times[filename], source_times[filename])
+                                  for filename in written)
+        return {filename: errors[paths[filename]] for filename in written if paths[filename] in errors}
+
+    # Cores are shared between images and encoder threads, so a run never
+    # uses more threads than the machine has cores
+    stats_current = 0
+    for filename, error in run_pipeline(image_list, decode, encode, write, read=read, flush=flush):
+        stats_current += 1
+        img_path = os.path.join(target_folder, filename)
+        compressed_path = os.path.join(compress_folder, f"{filename}{backend.extension}")
+        identity = identities.pop(filename, None)
+        source_times.pop(filename, None)
+        metadata.pop(filename, None)
+        if error is not None:
+            print(f"Error processing {filename}: {error}")
+            if identity is not None:
+                manifest.record(img_path, identity, compressed_path, settings, 'failed', str(error))
+        else:
+            print(f"{stats_current}/{stats_max} processed: {filename}")
+            manifest.record(img_path, identity, compressed_path, settings)
+    manifest.close()
 
 if __name__ == "__main__":
     main()
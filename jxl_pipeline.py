@@ -0,0 +1,177 @@
+import os
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+import imagecodecs
+from jxl_exe import transcode_jpeg_with_exe
+from media_meta import jpeg_dimensions
+
+# An image gets one encoder thread per this many pixels (libjxl splits the
+# frame into 256x256 groups, so small images cannot use more than a few)
+PIXELS_PER_THREAD = 4_000_000
+JPEG_EXTENSIONS = {'.jpg', '.jpeg'}
+# Optional read stage: files are read ahead of the decoders by this many
+# threads, up to this many raw bytes held in memory. Reads wait on storage,
+# not the CPU, so they do not count against the cores.
+READ_THREADS = 8
+READ_AHEAD_BYTES = 512 << 20
+# Most encoded outputs handed to the writer in one go
+WRITE_BATCH = 32
+
+class JpegSource(NamedTuple):
+    """JPEG bytes queued for lossless transcoding in place of a decoded pixel array."""
+    data: bytes
+    width: int
+    height: int
+
+def pixel_count(payload) -> int:
+    if isinstance(payload, JpegSource):
+        return payload.width * payload.height
+    return payload.shape[0] * payload.shape[1]
+
+def jpeg_source(file_path, data: bytes) -> Optional[JpegSource]:
+    """The bytes read from file_path as a JpegSource if JPEG XL can repack them losslessly, else None."""
+    if os.path.splitext(file_path)[1].lower() not in JPEG_EXTENSIONS:
+        return None
+    size = jpeg_dimensions(data)
+    return JpegSource(data, *size) if size else None
+
+def read_jpeg_source(file_path) -> Optional[JpegSource]:
+    """The file as a JpegSource if it is a JPEG that JPEG XL can repack losslessly, else None."""
+    if os.path.splitext(file_path)[1].lower() not in JPEG_EXTENSIONS:
+        return None
+    with open(file_path, 'rb') as f:
+        return jpeg_source(file_path, f.read())
+
+def transcode_jpeg(source: JpegSource, numthreads: int) -> bytes:
+    """Recompress a JPEG's DCT coefficients as JPEG XL, without decoding to pixels.
+
+    The original JPEG can be reconstructed bit for bit from the result.
+    Uses imagecodecs when it has the JPEG repacking call, cjxl otherwise.
+    """
+    if hasattr(imagecodecs, 'jpegxl_encode_jpeg'):
+        return imagecodecs.jpegxl_encode_jpeg(source.data, numthreads=numthreads)
+    return transcode_jpeg_with_exe(source.data, numthreads)
+
+def threads_for(pixels: int, cores: int, free: int, remaining: int) -> int:
+    """Encoder threads for one image.
+
+    Large images get more threads, small ones a single thread so many run
+    side by side. Near the end of a run, when fewer images remain than
+    cores, idle cores are handed out to the remaining images as well.
+    """
+    threads = max(1, pixels // PIXELS_PER_THREAD)
+    if remaining:
+        threads = max(threads, min(free, cores // remaining))
+    return min(threads, cores)
+
+def _write_batch(write: Callable, flush: Optional[Callable], batch) -> List[Tuple[object, Optional[BaseException]]]:
+    results = []
+    for job, data in batch:
+        try:
+            write(job, data)
+            results.append((job, None))
+        except Exception as e:
+            results.append((job, e))
+    if flush is not None:
+        written = [job for job, error in results if error is None]
+        try:
+            failed = flush(written) or {}
+        except Exception as e:
+            failed = dict.fromkeys(written, e)
+        results = [(job, error or failed.get(job)) for job, error in results]
+    return results
+
+def run_pipeline(jobs: Iterable, decode: Callable, encode: Callable, write: Callable,
+                 cores: Optional[int] = None, read: Optional[Callable] = None,
+                 read_ahead_bytes: int = READ_AHEAD_BYTES,
+                 flush: Optional[Callable] = None) -> Iterator[Tuple[object, Optional[BaseException]]]:
+    """Read, decode, encode and write jobs as overlapping stages and yield (job, error) as each finishes.
+
+    decode(job) returns a pixel array or a JpegSource, encode(job, payload,
+    numthreads) the encoded bytes and write(job, data) stores them. Decoding
+    and encoding run on threads (the imagecodecs calls release the GIL) and
+    share one budget of cores: a decode holds one core, an encode as many as
+    it was given threads, so the machine is never asked to run more threads
+    than it has cores.
+
+    With read(job) given, the raw bytes are fetched first by READ_THREADS
+    I/O threads, at most read_ahead_bytes ahead of the decoders, and decode
+    is called as decode(job, data). Workers then never wait on slow (e.g.
+    network) storage while holding a core.
+
+    Writes happen on a single writer thread, which takes every encoded
+    output that is ready (up to WRITE_BATCH) at once. flush(jobs), if given,
+    then runs on the writer thread for the jobs of the batch that were
+    written, for per-file work that is cheaper done in bulk, and may return
+    {job: error} for the ones it failed on.
+    """
+    cores = cores or os.cpu_count() or 1
+    waiting = deque(jobs)
+    fetched = deque()
+    decoded = deque()
+    encoded = deque()
+    free = cores
+    reading = 0
+    buffered = 0
+    writing = False
+    futures = {}
+
+    with ThreadPoolExecutor(max_workers=READ_THREADS) as readers, \
+            ThreadPoolExecutor(max_workers=cores) as decoders, \
+            ThreadPoolExecutor(max_workers=cores) as encoders, \
+            ThreadPoolExecutor(max_workers=1) as writer:
+        while waiting or fetched or decoded or encoded or futures:
+            if encoded and not writing:
+                batch = [encoded.popleft() for _ in range(min(WRITE_BATCH, len(encoded)))]
+                writing = True
+                futures[writer.submit(_write_batch, write, flush, batch)] = ('write', None, 0, 0)
+            # Encodes first: they free the memory held by decoded images
+            while decoded:
+                job, payload = decoded[0]
+                threads = threads_for(pixel_count(payload), cores, free,
+                                      len(waiting) + len(fetched) + len(decoded))
+                if threads > free:
+                    break
+                decoded.popleft()
+                free -= threads
+                futures[encoders.submit(encode, job, payload, threads)] = ('encode', job, threads, 0)
+            # Reads only wait for the memory budget, so they run ahead of everything else
+            while read is not None and waiting and reading < READ_THREADS and buffered < read_ahead_bytes:
+                job = waiting.popleft()
+                reading += 1
+                futures[readers.submit(read, job)] = ('read', job, 0, 0)
+            # Decode ahead only while no decoded image is waiting for cores. A
+            # decode holds a core, so at most cores decoded images are ever queued
+            source = fetched if read is not None else waiting
+            while source and not decoded and free > 0:
+                free -= 1
+                if read is not None:
+                    job, data = source.popleft()
+                    futures[decoders.submit(decode, job, data)] = ('decode', job, 1, len(data))
+                else:
+                    job = source.popleft()
+                    futures[decoders.submit(decode, job)] = ('decode', job, 1, 0)
+
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, job, threads, size = futures.pop(future)
+                free += threads
+                buffered -= size
+                if stage == 'read':
+                    reading -= 1
+                elif stage == 'write':
+                    writing = False
+                error = future.exception()
+                if error is not None:
+                    yield job, error
+                elif stage == 'read':
+                    data = future.result()
+                    buffered += len(data)
+                    fetched.append((job, data))
+                elif stage == 'decode':
+                    decoded.append((job, future.result()))
+                elif stage == 'encode':
+                    encoded.append((job, future.result()))
+                else:
+                    yield from future.result()
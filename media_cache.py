@@ -0,0 +1,216 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+# Shared by all tools; override with the MEDIA_CACHE_PATH environment variable
+DEFAULT_CACHE_PATH = os.environ.get('MEDIA_CACHE_PATH') or os.path.join(
+    os.path.expanduser('~'), '.cache', 'image-video-tools', 'media_cache.sqlite3')
+# Least recently used entries are evicted once the database grows past this
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+# Writes are grouped into transactions of this many statements
+COMMIT_EVERY = 1000
+
+# Per-file analysis results and their SQL types. Columns missing from an
+# existing database are added when it is opened.
+COLUMNS = {
+    'black': 'INTEGER',
+    'black_threshold': 'INTEGER',
+    'capture_date': 'TEXT',
+    'width': 'INTEGER',
+    'height': 'INTEGER',
+    'dtype': 'TEXT',
+    'content_hash': 'TEXT',
+    'conversion_status': 'TEXT',
+    'dhash': 'TEXT',
+}
+
+Identity = Tuple[int, int, int]
+# (table, primary key) of everything subject to LRU eviction
+TABLES = (('files', 'path'), ('derived', 'key'))
+
+def cache_key(path) -> str:
+    """Normalized absolute path used as the primary key."""
+    return os.path.normcase(os.path.abspath(str(path)))
+
+def file_identity(path, stat_result: Optional[os.stat_result] = None) -> Identity:
+    """(size, mtime_ns, inode) of a file. Pass a stat result to avoid another syscall."""
+    st = stat_result if stat_result is not None else os.stat(path)
+    return st.st_size, st.st_mtime_ns, st.st_ino
+
+def identity_matches(row: Dict, identity: Identity) -> bool:
+    """Check a cached row against the current file identity.
+
+    An inode of 0 means "unknown" (os.scandir on Windows does not fill it in)
+    and is not compared.
+    """
+    size, mtime_ns, inode = identity
+    if row['size'] != size or row['mtime_ns'] != mtime_ns:
+        return False
+    return not inode or not row['inode'] or row['inode'] == inode
+
+class MediaCache:
+    """On-disk cache of per-file analysis results, keyed by path and validated by identity.
+
+    Backed by SQLite in WAL mode, so several tools (or threads, each with
+    its own MediaCache) can read while one writes. One MediaCache may also
+    be shared between threads; its calls are serialized. Results that
+    depend only on file content (not on where the file lives) go in a
+    separate key/value table, see get_derived. Use as a context manager
+    so pending writes are committed and eviction runs on exit.
+    """
+
+    def __init__(self, db_path: str = DEFAULT_CACHE_PATH, max_bytes: int = DEFAULT_MAX_BYTES):
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.RLock()
+        self.conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS files ('
+            'path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, inode INTEGER, last_access REAL)')
+        existing = {row['name'] for row in self.conn.execute('PRAGMA table_info(files)')}
+        for column, sql_type in COLUMNS.items():
+            if column not in existing:
+                self.conn.execute(f'ALTER TABLE files ADD COLUMN {column} {sql_type}')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS files_last_access ON files (last_access)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS derived (key TEXT PRIMARY KEY, value TEXT, last_access REAL)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS derived_last_access ON derived (last_access)')
+        self.conn.commit()
+        self._uncommitted = 0
+        self._accessed = set()
+        self._derived_accessed = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def get(self, path, stat_result: Optional[os.stat_result] = None) -> Optional[Dict]:
+        """Cached fields for path, or None if missing or the file changed since it was cached."""
+        key = cache_key(path)
+        with self._lock:
+            row = self.conn.execute('SELECT * FROM files WHERE path = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        try:
+            identity = file_identity(path, stat_result)
+        except OSError:
+            return None
+        row = dict(row)
+        if not identity_matches(row, identity):
+            return None
+        with self._lock:
+            self._accessed.add(key)
+        return row
+
+    def put(self, path, stat_result: Optional[os.stat_result] = None, **fields) -> None:
+        """Store analysis fields for path. Fields cached under an older identity are dropped."""
+        unknown = set(fields) - set(COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown cache fields: {', '.join(sorted(unknown))}")
+        key = cache_key(path)
+        size, mtime_ns, inode = file_identity(path, stat_result)
+        with self._lock:
+            row = self.conn.execute('SELECT size, mtime_ns, inode FROM files WHERE path = ?', (key,)).fetchone()
+            if row is not None and identity_matches(dict(row), (size, mtime_ns, inode)):
+                assignments = ', '.join(f'{column} = ?' for column in fields)
+                self.conn.execute(f'UPDATE files SET last_access = ?{", " if fields else ""}{assignments} WHERE path = ?',
+                                  (time.time(), *fields.values(), key))
+            else:
+                values = {column: None for column in COLUMNS}
+                values.update(fields)
+                columns = ', '.join(values)
+                placeholders = ', '.join('?' * (len(values) + 5))
+                self.conn.execute(f'INSERT OR REPLACE INTO files (path, size, mtime_ns, inode, last_access, {columns}) '
+                                  f'VALUES ({placeholders})',
+                                  (key, size, mtime_ns, inode, time.time(), *values.values()))
+            self._written()
+
+    def move(self, old_path, new_path) -> None:
+        """Carry cached fields over after a file was renamed or moved."""
+        new_key = cache_key(new_path)
+        with self._lock:
+            self.conn.execute('DELETE FROM files WHERE path = ?', (new_key,))
+            self.conn.execute('UPDATE files SET path = ? WHERE path = ?', (new_key, cache_key(old_path)))
+            self._written()
+
+    def forget(self, paths: Iterable) -> None:
+        """Drop entries, e.g. for deleted files."""
+        keys = [(cache_key(path),) for path in paths]
+        with self._lock:
+            self.conn.executemany('DELETE FROM files WHERE path = ?', keys)
+            self._written()
+
+    def get_derived(self, key: str) -> Optional[str]:
+        """Value stored under key by put_derived, or None.
+
+        For results that depend only on file content and settings, so the
+        key should contain a content hash (e.g. content_hash) rather than a
+        path. Such entries survive renames and are shared by copies.
+        """
+        with self._lock:
+            row = self.conn.execute('SELECT value FROM derived WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            self._derived_accessed.add(key)
+            return row['value']
+
+    def put_derived(self, key: str, value: str) -> None:
+        with self._lock:
+            self.conn.execute('INSERT OR REPLACE INTO derived (key, value, last_access) VALUES (?, ?, ?)',
+                              (key, value, time.time()))
+            self._written()
+
+    def _written(self) -> None:
+        self._uncommitted += 1
+        if self._uncommitted >= COMMIT_EVERY:
+            self.flush()
+
+    def flush(self) -> None:
+        """Commit pending writes and record which entries were read."""
+        with self._lock:
+            now = time.time()
+            for (table, key_column), accessed in zip(TABLES, (self._accessed, self._derived_accessed)):
+                if accessed:
+                    self.conn.executemany(f'UPDATE {table} SET last_access = ? WHERE {key_column} = ?',
+                                          ((now, key) for key in accessed))
+                    accessed.clear()
+            self.conn.commit()
+            self._uncommitted = 0
+
+    def size_bytes(self) -> int:
+        """Bytes used by live pages of the database."""
+        with self._lock:
+            page_size = self.conn.execute('PRAGMA page_size').fetchone()[0]
+            page_count = self.conn.execute('PRAGMA page_count').fetchone()[0]
+            free_pages = self.conn.execute('PRAGMA freelist_count').fetchone()[0]
+        return (page_count - free_pages) * page_size
+
+    def evict(self) -> int:
+        """Drop least recently used entries until the database is back under 90% of max_bytes."""
+        with self._lock:
+            self.flush()
+            used = self.size_bytes()
+            if used <= self.max_bytes:
+                return 0
+            dropped = 0
+            for table, key_column in TABLES:
+                total = self.conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+                drop = int(total * (1 - 0.9 * self.max_bytes / used)) + 1
+                self.conn.execute(f'DELETE FROM {table} WHERE {key_column} IN '
+                                  f'(SELECT {key_column} FROM {table} ORDER BY last_access LIMIT ?)', (drop,))
+                dropped += min(drop, total)
+            self.conn.commit()
+            self.conn.execute('PRAGMA incremental_vacuum')
+            return dropped
+
+    def close(self) -> None:
+        with self._lock:
+            self.evict()
+            self.conn.close()
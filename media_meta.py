@@ -0,0 +1,383 @@
+import mmap
+import struct
+import zlib
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterator, Optional, Tuple
+
+# DateTimeOriginal, DateTimeDigitized, DateTime, DateTimeCreated - in order of preference
+EXIF_DATE_TAGS = (36867, 36868, 306, 50971)
+EXIF_IFD_POINTER = 34665
+# MP4/MOV timestamps count seconds from this epoch (UTC)
+QUICKTIME_EPOCH = datetime(1904, 1, 1)
+# Older QuickTime files may start without an ftyp box
+QUICKTIME_TOP_BOXES = {b'moov', b'mdat', b'wide', b'free', b'skip'}
+XMP_JPEG_PREFIX = b'http://ns.adobe.com/xap/1.0/\0'
+XMP_PNG_KEYWORD = b'XML:com.adobe.xmp'
+ICC_JPEG_PREFIX = b'ICC_PROFILE\0'
+# TIFF InterColorProfile tag
+TIFF_ICC_TAG = 34675
+HEIF_BRANDS = {b'heic', b'heix', b'heim', b'heis', b'hevc', b'hevx', b'mif1', b'msf1', b'avif', b'avis'}
+
+def iter_boxes(data, start: int, end: int) -> Iterator[Tuple[bytes, int, int]]:
+    """Yield (type, payload start, payload end) for ISOBMFF boxes between start and end."""
+    pos = start
+    while pos + 8 <= end:
+        size, box_type = struct.unpack_from('>I4s', data, pos)
+        header = 8
+        if size == 1:
+            size, = struct.unpack_from('>Q', data, pos + 8)
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header or pos + size > end:
+            return
+        yield box_type, pos + header, pos + size
+        pos += size
+
+def find_box(data, start: int, end: int, box_type: bytes) -> Optional[Tuple[int, int]]:
+    """Payload range of the first box of the given type, or None."""
+    for found_type, payload_start, payload_end in iter_boxes(data, start, end):
+        if found_type == box_type:
+            return payload_start, payload_end
+    return None
+
+def tiff_tags(tiff: bytes, wanted) -> Dict[int, bytes]:
+    """Raw ASCII values of the wanted tags from IFD0 and the Exif sub-IFD of a TIFF/Exif blob."""
+    bo = {b'II': '<', b'MM': '>'}.get(tiff[:2])
+    if bo is None:
+        return {}
+    ifd_offsets = [struct.unpack_from(bo + 'I', tiff, 4)[0]]
+    values = {}
+    # A corrupt or crafted pointer can lead back to an IFD already read
+    visited = set()
+    while ifd_offsets:
+        offset = ifd_offsets.pop()
+        if offset in visited or offset + 2 > len(tiff):
+            continue
+        visited.add(offset)
+        count, = struct.unpack_from(bo + 'H', tiff, offset)
+        for i in range(count):
+            entry = offset + 2 + i * 12
+            if entry + 12 > len(tiff):
+                break
+            tag, value_type, value_count = struct.unpack_from(bo + 'HHI', tiff, entry)
+            if tag == EXIF_IFD_POINTER:
+                ifd_offsets.append(struct.unpack_from(bo + 'I', tiff, entry + 8)[0])
+            elif tag in wanted and value_type == 2:
+                value_offset = entry + 8
+                if value_count > 4:
+                    value_offset, = struct.unpack_from(bo + 'I', tiff, entry + 8)
+                values[tag] = tiff[value_offset:value_offset + value_count].rstrip(b'\0 ')
+    return values
+
+def exif_date(tiff: bytes) -> Optional[datetime]:
+    """Capture date from a TIFF/Exif blob, preferring DateTimeOriginal."""
+    values = tiff_tags(tiff, EXIF_DATE_TAGS)
+    for tag in EXIF_DATE_TAGS:
+        if tag in values:
+            try:
+                return datetime.strptime(values[tag].decode('ascii'), '%Y:%m:%d %H:%M:%S')
+            except (UnicodeDecodeError, ValueError):
+                continue
+    return None
+
+def jpeg_exif(data) -> Optional[bytes]:
+    """TIFF payload of the JPEG APP1 Exif segment. Stops at the first scan."""
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            return None
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            pos += 1
+            continue
+        if marker == 0xDA:
+            return None
+        length, = struct.unpack_from('>H', data, pos + 2)
+        if marker == 0xE1 and data[pos + 4:pos + 10] == b'Exif\0\0':
+            return data[pos + 10:pos + 2 + length]
+        pos += 2 + length
+    return None
+
+def jpeg_xmp(data) -> Optional[bytes]:
+    """XMP packet of the JPEG APP1 XMP segment. Stops at the first scan."""
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            return None
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            pos += 1
+            continue
+        if marker == 0xDA:
+            return None
+        length, = struct.unpack_from('>H', data, pos + 2)
+        if marker == 0xE1 and data[pos + 4:pos + 4 + len(XMP_JPEG_PREFIX)] == XMP_JPEG_PREFIX:
+            return data[pos + 4 + len(XMP_JPEG_PREFIX):pos + 2 + length]
+        pos += 2 + length
+    return None
+
+def jpeg_dimensions(data) -> Optional[Tuple[int, int]]:
+    """(width, height) from the frame header of a baseline, extended or progressive Huffman JPEG.
+
+    None for anything else, including arithmetic-coded and lossless JPEGs.
+    """
+    if data[:2] != b'\xff\xd8':
+        return None
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            return None
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            pos += 1
+            continue
+        if marker == 0xDA:
+            return None
+        if marker in (0xC0, 0xC1, 0xC2):
+            if pos + 9 > len(data):
+                return None
+            height, width = struct.unpack_from('>HH', data, pos + 5)
+            return width, height
+        if 0xC3 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            return None
+        length, = struct.unpack_from('>H', data, pos + 2)
+        pos += 2 + length
+    return None
+
+def png_exif(data) -> Optional[bytes]:
+    """Payload of the PNG eXIf chunk, looked for up to the first IDAT."""
+    pos = 8
+    while pos + 8 <= len(data):
+        length, chunk_type = struct.unpack_from('>I4s', data, pos)
+        if chunk_type == b'eXIf':
+            return data[pos + 8:pos + 8 + length]
+        if chunk_type in (b'IDAT', b'IEND'):
+            return None
+        pos += 12 + length
+    return None
+
+def png_xmp(data) -> Optional[bytes]:
+    """XMP packet of the PNG iTXt chunk keyed XML:com.adobe.xmp, looked for up to the first IDAT."""
+    pos = 8
+    while pos + 8 <= len(data):
+        length, chunk_type = struct.unpack_from('>I4s', data, pos)
+        if chunk_type == b'iTXt':
+            chunk = data[pos + 8:pos + 8 + length]
+            keyword, _, rest = chunk.partition(b'\0')
+            if keyword == XMP_PNG_KEYWORD and len(rest) >= 2:
+                compressed = rest[0]
+                # Skip the language tag and translated keyword
+                text = rest[2:].split(b'\0', 2)[-1]
+                try:
+                    return zlib.decompress(text) if compressed else text
+                except zlib.error:
+                    return None
+        if chunk_type in (b'IDAT', b'IEND'):
+            return None
+        pos += 12 + length
+    return None
+
+def jpeg_icc(data) -> Optional[bytes]:
+    """ICC profile from the JPEG APP2 ICC_PROFILE segments, joined in sequence order. Stops at the first scan."""
+    chunks = {}
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            break
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            pos += 1
+            continue
+        if marker == 0xDA:
+            break
+        length, = struct.unpack_from('>H', data, pos + 2)
+        if marker == 0xE2 and data[pos + 4:pos + 4 + len(ICC_JPEG_PREFIX)] == ICC_JPEG_PREFIX:
+            # Sequence number and chunk count follow the prefix
+            start = pos + 4 + len(ICC_JPEG_PREFIX)
+            chunks[data[start]] = data[start + 2:pos + 2 + length]
+        pos += 2 + length
+    return b''.join(chunks[seq] for seq in sorted(chunks)) if chunks else None
+
+def png_icc(data) -> Optional[bytes]:
+    """ICC profile from the PNG iCCP chunk, looked for up to the first IDAT."""
+    pos = 8
+    while pos + 8 <= len(data):
+        length, chunk_type = struct.unpack_from('>I4s', data, pos)
+        if chunk_type == b'iCCP':
+            # Profile name, a zero byte, the compression method, then the deflated profile
+            _, _, rest = data[pos + 8:pos + 8 + length].partition(b'\0')
+            try:
+                return zlib.decompress(rest[1:])
+            except zlib.error:
+                return None
+        if chunk_type in (b'IDAT', b'IEND'):
+            return None
+        pos += 12 + length
+    return None
+
+def tiff_icc(tiff) -> Optional[bytes]:
+    """ICC profile from the InterColorProfile tag of a TIFF's first IFD."""
+    bo = {b'II': '<', b'MM': '>'}.get(tiff[:2])
+    if bo is None:
+        return None
+    offset, = struct.unpack_from(bo + 'I', tiff, 4)
+    if offset + 2 > len(tiff):
+        return None
+    count, = struct.unpack_from(bo + 'H', tiff, offset)
+    for i in range(count):
+        entry = offset + 2 + i * 12
+        if entry + 12 > len(tiff):
+            break
+        tag, _, value_count, value_offset = struct.unpack_from(bo + 'HHII', tiff, entry)
+        if tag == TIFF_ICC_TAG and value_count > 4:
+            return tiff[value_offset:value_offset + value_count] or None
+    return None
+
+def embedded_metadata(data) -> Dict[str, bytes]:
+    """Exif (TIFF payload), XMP and ICC blobs embedded in JPEG, PNG or TIFF bytes, keyed 'exif', 'xmp' and 'icc'.
+
+    TIFF sources only report 'icc': their Exif and XMP live in the file's
+    own tags, not in a blob that can be copied as a whole.
+    """
+    if data[:2] == b'\xff\xd8':
+        found = {'exif': jpeg_exif(data), 'xmp': jpeg_xmp(data), 'icc': jpeg_icc(data)}
+    elif data[:8] == b'\x89PNG\r\n\x1a\n':
+        found = {'exif': png_exif(data), 'xmp': png_xmp(data), 'icc': png_icc(data)}
+    elif data[:4] in (b'II*\0', b'MM\0*'):
+        try:
+            found = {'icc': tiff_icc(data)}
+        except struct.error:
+            return {}
+    else:
+        return {}
+    return {kind: blob for kind, blob in found.items() if blob}
+
+def heif_exif(data) -> Optional[bytes]:
+    """TIFF payload of the Exif item of a HEIC/AVIF file, located through meta/iinf/iloc."""
+    meta = find_box(data, 0, len(data), b'meta')
+    if meta is None:
+        return None
+    # meta is a full box: skip version and flags
+    children = meta[0] + 4, meta[1]
+
+    exif_item = None
+    iinf = find_box(data, *children, b'iinf')
+    if iinf is not None:
+        version = data[iinf[0]]
+        entries_start = iinf[0] + (6 if version == 0 else 8)
+        for box_type, start, end in iter_boxes(data, entries_start, iinf[1]):
+            if box_type != b'infe' or data[start] < 2:
+                continue
+            item_id_size = 2 if data[start] == 2 else 4
+            item_id = int.from_bytes(data[start + 4:start + 4 + item_id_size], 'big')
+            item_type = data[start + 6 + item_id_size:start + 10 + item_id_size]
+            if item_type == b'Exif':
+                exif_item = item_id
+                break
+    iloc = find_box(data, *children, b'iloc')
+    if exif_item is None or iloc is None:
+        return None
+
+    pos = iloc[0]
+    version = data[pos]
+    offset_size, length_size = data[pos + 4] >> 4, data[pos + 4] & 0xF
+    base_offset_size, index_size = data[pos + 5] >> 4, data[pos + 5] & 0xF
+    pos += 6
+    id_size = 2 if version < 2 else 4
+    item_count = int.from_bytes(data[pos:pos + id_size], 'big')
+    pos += id_size
+
+    def read(size):
+        nonlocal pos
+        value = int.from_bytes(data[pos:pos + size], 'big')
+        pos += size
+        return value
+
+    for _ in range(item_count):
+        item_id = read(id_size)
+        construction_method = read(2) & 0xF if version in (1, 2) else 0
+        read(2)  # data_reference_index
+        base_offset = read(base_offset_size)
+        extent_count = read(2)
+        extents = []
+        for _ in range(extent_count):
+            if version in (1, 2) and index_size:
+                read(index_size)
+            extents.append((read(offset_size), read(length_size)))
+        if item_id != exif_item:
+            continue
+        if construction_method != 0 or not extents:
+            return None
+        offset, length = extents[0]
+        payload = data[base_offset + offset:base_offset + offset + length]
+        # Exif item data starts with the offset to the TIFF header
+        tiff_offset, = struct.unpack_from('>I', payload, 0)
+        return payload[4 + tiff_offset:]
+    return None
+
+def quicktime_date(data) -> Optional[datetime]:
+    """Creation date of an MP4/MOV from moov/mvhd (UTC), else from a udta ©day string."""
+    moov = find_box(data, 0, len(data), b'moov')
+    if moov is None:
+        return None
+    mvhd = find_box(data, *moov, b'mvhd')
+    if mvhd is not None:
+        version = data[mvhd[0]]
+        if version == 1:
+            seconds, = struct.unpack_from('>Q', data, mvhd[0] + 4)
+        else:
+            seconds, = struct.unpack_from('>I', data, mvhd[0] + 4)
+        if seconds:
+            return QUICKTIME_EPOCH + timedelta(seconds=seconds)
+
+    udta = find_box(data, *moov, b'udta')
+    day = find_box(data, *udta, b'\xa9day') if udta is not None else None
+    if day is None:
+        return None
+    # QuickTime string atom: 16-bit length, 16-bit language, then the text
+    length, = struct.unpack_from('>H', data, day[0])
+    text = data[day[0] + 4:day[0] + 4 + length].decode('utf-8', 'replace').strip()
+    try:
+        parsed = datetime.fromisoformat(text.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+def read_capture_date(file_path) -> Optional[datetime]:
+    """Capture date read straight from the container headers, without decoding anything.
+
+    Covers JPEG/TIFF Exif, PNG eXIf, HEIC/AVIF Exif items and MP4/MOV mvhd/©day.
+    The file is memory-mapped, so only the pages holding the headers are read.
+    Returns None when the format is not covered or carries no date; image
+    dates are local time as written by the camera, video dates are UTC.
+    """
+    with open(file_path, 'rb') as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty file
+            return None
+        try:
+            head = data[:12]
+            if head[:2] == b'\xff\xd8':
+                exif = jpeg_exif(data)
+            elif head[:8] == b'\x89PNG\r\n\x1a\n':
+                exif = png_exif(data)
+            elif head[:4] in (b'II*\0', b'MM\0*'):
+                exif = data
+            elif head[4:8] in QUICKTIME_TOP_BOXES:
+                return quicktime_date(data)
+            elif head[4:8] == b'ftyp':
+                if head[8:12] not in HEIF_BRANDS:
+                    return quicktime_date(data)
+                exif = heif_exif(data)
+            else:
+                return None
+            return exif_date(exif) if exif else None
+        except (struct.error, IndexError, ValueError):
+            return None
+        finally:
+            data.close()
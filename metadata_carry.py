@@ -0,0 +1,119 @@
+import ctypes
+import os
+import struct
+import sys
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Tuple
+from media_meta import iter_boxes
+
+# A JPEG XL container starts with this signature box, followed by ftyp
+JXL_SIGNATURE = b'\0\0\0\x0cJXL \r\n\x87\n'
+JXL_FTYP = b'\0\0\0\x14ftypjxl \0\0\0\0jxl '
+# Container box types for the metadata kinds returned by media_meta.embedded_metadata
+METADATA_BOXES = {'exif': b'Exif', 'xmp': b'xml '}
+UNIX_EPOCH = datetime(1970, 1, 1)
+WINDOWS_EPOCH = datetime(1601, 1, 1)
+
+def _box(box_type: bytes, payload: bytes) -> bytes:
+    return struct.pack('>I4s', 8 + len(payload), box_type) + payload
+
+def add_jxl_metadata(jxl: bytes, metadata: Dict[str, bytes]) -> bytes:
+    """JPEG XL bytes with Exif and XMP boxes from the source added to the container.
+
+    A bare codestream is wrapped in a container (signature, ftyp, metadata,
+    jxlc); an existing container, as made by lossless JPEG transcoding,
+    gets the boxes inserted after its ftyp, unless it already carries that
+    kind, plain or Brotli-compressed. The pixels are untouched. ICC profiles
+    are not boxes in JPEG XL but part of the codestream header: a transcoded
+    JPEG keeps its own, and pixel encodes get the 'icc' entry of metadata
+    through cjxl (see jxl_exe.encode_pixels_with_exe), so it is skipped here.
+    """
+    if not metadata:
+        return jxl
+    if jxl[:len(JXL_SIGNATURE)] != JXL_SIGNATURE:
+        head, tail = JXL_SIGNATURE + JXL_FTYP, _box(b'jxlc', jxl)
+        present = set()
+    else:
+        boxes = list(iter_boxes(jxl, 0, len(jxl)))
+        # Brotli-compressed (brob) boxes name the type they wrap in their first four bytes
+        present = {jxl[start:start + 4] if box_type == b'brob' else box_type for box_type, start, _ in boxes}
+        # Metadata goes after ftyp and the optional level box that must follow it
+        split = next(end for box_type, _, end in boxes if box_type == b'ftyp')
+        if b'jxll' in present:
+            split = next(end for box_type, _, end in boxes if box_type == b'jxll')
+        head, tail = jxl[:split], jxl[split:]
+    inserted = []
+    for kind, blob in metadata.items():
+        box_type = METADATA_BOXES.get(kind)
+        if box_type is None or box_type in present:
+            continue
+        # The Exif box payload starts with the offset of the TIFF header
+        payload = b'\0\0\0\0' + blob if kind == 'exif' else blob
+        inserted.append(_box(box_type, payload))
+    if not inserted:
+        return jxl
+    return b''.join([head, *inserted, tail])
+
+def _utc_naive(dt: datetime) -> datetime:
+    # Naive datetimes are taken to be UTC already
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+def _datetime_to_ns(dt: datetime) -> int:
+    delta = _utc_naive(dt) - UNIX_EPOCH
+    return (delta.days * 86400 + delta.seconds) * 10**9 + delta.microseconds * 1000
+
+class _FILETIME(ctypes.Structure):
+    _fields_ = [("dwLowDateTime", ctypes.c_uint32),
+                ("dwHighDateTime", ctypes.c_uint32)]
+
+def _datetime_to_filetime(dt: datetime) -> _FILETIME:
+    # FILETIME counts 100-nanosecond intervals since 1601, split into two 32-bit halves
+    delta = _utc_naive(dt) - WINDOWS_EPOCH
+    intervals = (delta.days * 86400 + delta.seconds) * 10**7 + delta.microseconds * 10
+    return _FILETIME(dwLowDateTime=intervals & 0xFFFFFFFF, dwHighDateTime=(intervals >> 32) & 0xFFFFFFFF)
+
+def set_file_times(filepath: str, create_time: datetime, modify_time: datetime):
+    """Set a file's modification time, and its creation time where the OS allows it.
+
+    Windows goes through SetFileTime, which sets both. POSIX systems have
+    no settable creation time, so os.utime sets the access and modification
+    times to modify_time, in nanoseconds.
+    """
+    if sys.platform != 'win32':
+        modify_ns = _datetime_to_ns(modify_time)
+        os.utime(filepath, ns=(modify_ns, modify_ns))
+        return
+
+    create_time_filetime = _datetime_to_filetime(create_time)
+    modify_time_filetime = _datetime_to_filetime(modify_time)
+
+    # Load Windows API functions
+    kernel32 = ctypes.windll.kernel32
+    handle = kernel32.CreateFileW(filepath, 0x40000000, 0, None, 3, 0, None)  # GENERIC_WRITE
+
+    if handle == -1:
+        raise FileNotFoundError("The file could not be opened")
+
+    try:
+        # Set file times
+        success = kernel32.SetFileTime(handle, ctypes.byref(create_time_filetime), None,
+                                       ctypes.byref(modify_time_filetime))
+        if not success:
+            raise OSError("Failed to set file times")
+    finally:
+        kernel32.CloseHandle(handle)
+
+def apply_file_times(entries: Iterable[Tuple[str, datetime, datetime]]) -> Dict[str, Exception]:
+    """set_file_times for a batch of (path, create_time, modify_time), e.g. everything one writer batch wrote.
+
+    Returns the errors by path instead of stopping at the first one.
+    """
+    errors = {}
+    for filepath, create_time, modify_time in entries:
+        try:
+            set_file_times(filepath, create_time, modify_time)
+        except OSError as e:
+            errors[filepath] = e
+    return errors
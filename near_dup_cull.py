@@ -0,0 +1,188 @@
+import os
+from PIL import Image
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+from typing import Dict, List, Optional, Tuple
+from media_cache import MediaCache
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.tif', '.tiff', '.bmp', '.webp'}
+# dHash compares neighbouring pixels of a HASH_SIZE+1 x HASH_SIZE thumbnail
+HASH_SIZE = 8
+# Images per task sent to a worker process
+HASH_BATCH = 64
+DEFAULT_MAX_DISTANCE = 4
+
+def dhash(image_path: str) -> Optional[int]:
+    """64-bit difference hash of an image, computed from a reduced decode."""
+    try:
+        with Image.open(image_path) as img:
+            # JPEGs decode straight to a small grayscale image via DCT scaling
+            img.draft('L', (HASH_SIZE * 8, HASH_SIZE * 8))
+            small = img.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.BOX, reducing_gap=2.0)
+    except Exception as e:
+        print(f"Error hashing {image_path}: {str(e)}")
+        return None
+    pixels = small.tobytes()
+    value = 0
+    for y in range(HASH_SIZE):
+        row = pixels[y * (HASH_SIZE + 1):(y + 1) * (HASH_SIZE + 1)]
+        for x in range(HASH_SIZE):
+            value = (value << 1) | (row[x] > row[x + 1])
+    return value
+
+def hash_batch(image_paths: List[str]) -> List[Tuple[str, Optional[int]]]:
+    """Hash a batch of images in a worker process."""
+    return [(path, dhash(path)) for path in image_paths]
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+class BKTree:
+    """Burkhard-Keller tree over Hamming distance.
+
+    Each query only descends into children whose edge distance lies within
+    max_distance of the query's distance to the node (triangle inequality),
+    so lookups touch a small part of the tree instead of every hash.
+    """
+
+    def __init__(self):
+        self.root = None
+
+    def add(self, value: int, item) -> None:
+        node = (value, item, {})
+        if self.root is None:
+            self.root = node
+            return
+        current = self.root
+        while True:
+            distance = hamming(value, current[0])
+            child = current[2].get(distance)
+            if child is None:
+                current[2][distance] = node
+                return
+            current = child
+
+    def query(self, value: int, max_distance: int) -> List[Tuple[int, object]]:
+        """All (distance, item) within max_distance of value, nearest first."""
+        found = []
+        pending = [self.root] if self.root is not None else []
+        while pending:
+            node_value, item, children = pending.pop()
+            distance = hamming(value, node_value)
+            if distance <= max_distance:
+                found.append((distance, item))
+            for edge, child in children.items():
+                if distance - max_distance <= edge <= distance + max_distance:
+                    pending.append(child)
+        return sorted(found, key=lambda pair: pair[0])
+
+def find_images(folder_path: str) -> List[str]:
+    """All images below folder_path, sorted so bursts and snapshots stay in capture order."""
+    images = []
+    for root, _, files in os.walk(folder_path):
+        images.extend(os.path.join(root, name) for name in files
+                      if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS)
+    return sorted(images)
+
+def compute_hashes(images: List[str], cache: Optional[MediaCache]) -> Dict[str, int]:
+    """dHash per image: from the media cache when unchanged, else computed across a process pool."""
+    hashes = {}
+    missing = []
+    for image_path in images:
+        cached = cache.get(image_path) if cache is not None else None
+        if cached and cached['dhash']:
+            hashes[image_path] = int(cached['dhash'], 16)
+        else:
+            missing.append(image_path)
+    print(f"{len(hashes)} hashes from cache, {len(missing)} to compute")
+
+    batches = [missing[i:i + HASH_BATCH] for i in range(0, len(missing), HASH_BATCH)]
+    done = 0
+    with ProcessPoolExecutor(max_workers=multiprocessing.cpu_count()) as executor:
+        for results in executor.map(hash_batch, batches):
+            for image_path, value in results:
+                if value is None:
+                    continue
+                hashes[image_path] = value
+                if cache is not None:
+                    cache.put(image_path, dhash=f"{value:016x}")
+            done += len(results)
+            print(f"Progress: {done}/{len(missing)} hashed")
+    return hashes
+
+def find_near_duplicates(images: List[str], hashes: Dict[str, int],
+                         max_distance: int) -> List[Tuple[str, str, int]]:
+    """(duplicate, kept image, distance) for every image close to an earlier kept one.
+
+    Images are visited in order; each one either matches the nearest kept
+    image within max_distance or becomes a kept image itself.
+    """
+    tree = BKTree()
+    duplicates = []
+    for image_path in images:
+        value = hashes.get(image_path)
+        if value is None:
+            continue
+        matches = tree.query(value, max_distance)
+        if matches:
+            distance, keeper = matches[0]
+            duplicates.append((image_path, keeper, distance))
+        else:
+            tree.add(value, image_path)
+    return duplicates
+
+def main():
+    # Get folder path from user
+    folder_path = input("Enter folder path: ").strip()
+
+    # Validate folder
+    if not os.path.isdir(folder_path):
+        print("Error: Invalid folder path")
+        return
+
+    try:
+        max_distance = int(input(f"Max Hamming distance 0-64 (press Enter for {DEFAULT_MAX_DISTANCE}): ").strip()
+                           or DEFAULT_MAX_DISTANCE)
+    except ValueError:
+        print("Error: Distance must be a number")
+        return
+
+    images = find_images(folder_path)
+    print(f"\nHashing {len(images)} images using {multiprocessing.cpu_count()} processes...")
+    with MediaCache() as cache:
+        hashes = compute_hashes(images, cache)
+    duplicates = find_near_duplicates(images, hashes, max_distance)
+
+    # If no images to delete
+    if not duplicates:
+        print("\nNo near-duplicate images found.")
+        return
+
+    # Show images to be deleted
+    print(f"\nThe following {len(duplicates)} images are near-duplicates and will be deleted:")
+    for image_path, keeper, distance in duplicates:
+        print(f"- {os.path.relpath(image_path, folder_path)} (like {os.path.relpath(keeper, folder_path)}, distance {distance})")
+
+    # Ask for confirmation
+    confirm = input("\nDo you want to delete these images? (y/n): ").strip().lower()
+
+    if confirm == 'y':
+        print("\nDeleting images...")
+        deleted = []
+        for image_path, _, _ in duplicates:
+            try:
+                os.remove(image_path)
+                deleted.append(image_path)
+                print(f"Deleted: {os.path.relpath(image_path, folder_path)}")
+            except Exception as e:
+                print(f"Failed to delete {os.path.relpath(image_path, folder_path)}: {str(e)}")
+        with MediaCache() as cache:
+            cache.forget(deleted)
+        print("\nDeletion complete.")
+    else:
+        print("\nOperation cancelled.")
+
+if __name__ == "__main__":
+    # Required for Windows systems
+    multiprocessing.freeze_support()
+    main()
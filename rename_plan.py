@@ -0,0 +1,179 @@
+import json
+import os
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+JOURNAL_PREFIX = '.rename_journal_'
+TEMP_SUFFIX = '.renaming'
+
+def is_plan_file(path) -> bool:
+    """True for journals and temporary names created by this module, which renamers must skip."""
+    name = Path(path).name
+    return name.startswith(JOURNAL_PREFIX) or name.endswith(TEMP_SUFFIX)
+
+class RenamePlanner:
+    """Builds a collision-free rename plan in memory.
+
+    Each directory is listed once; candidate names are then checked against
+    that set instead of stat-ing the disk. Names are compared case-insensitively
+    so plans are safe on Windows and macOS volumes too.
+    """
+
+    def __init__(self):
+        self.entries: List[Tuple[Path, Path]] = []
+        self._taken: Dict[Path, Set[str]] = {}
+        self._next_counter: Dict[Tuple[Path, str], int] = {}
+
+    def _names(self, directory: Path) -> Set[str]:
+        names = self._taken.get(directory)
+        if names is None:
+            with os.scandir(directory) as entries:
+                names = {entry.name.casefold() for entry in entries}
+            self._taken[directory] = names
+        return names
+
+    def add(self, source: Path, name_for: Callable[[int], str]) -> Path:
+        """Plan a rename of source and return its target path.
+
+        name_for(0) is the preferred name, name_for(n) the n-th fallback.
+        Source names stay reserved, so a failed rename can never be
+        overwritten by another file in the plan.
+        """
+        directory = source.parent
+        names = self._names(directory)
+        key = (directory, name_for(0).casefold())
+        counter = self._next_counter.get(key, 0)
+        while name_for(counter).casefold() in names:
+            counter += 1
+        self._next_counter[key] = counter + 1
+        name = name_for(counter)
+        names.add(name.casefold())
+        target = directory / name
+        self.entries.append((source, target))
+        return target
+
+def _append(journal_path: Path, record: Dict) -> None:
+    with open(journal_path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+def read_journal(journal_path: Path) -> Tuple[List[Tuple[Path, Path, Path]], Optional[str]]:
+    """Planned (source, temp, target) entries and the last recorded phase."""
+    entries, phase = [], None
+    with open(journal_path, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if 'entries' in record:
+                entries = [tuple(Path(p) for p in entry) for entry in record['entries']]
+            phase = record.get('phase', phase)
+    return entries, phase
+
+def find_unfinished_journals(directory: Path) -> List[Path]:
+    """Journals in directory whose run was interrupted before completing."""
+    unfinished = []
+    for journal_path in sorted(Path(directory).glob(JOURNAL_PREFIX + '*')):
+        try:
+            _, phase = read_journal(journal_path)
+        except (OSError, ValueError):
+            continue
+        if phase not in ('done', 'undone'):
+            unfinished.append(journal_path)
+    return unfinished
+
+def apply_plan(entries: List[Tuple[Path, Path]], journal_dir: Path,
+               on_renamed: Optional[Callable[[Path, Path], None]] = None) -> Tuple[int, Path]:
+    """Apply a plan in two phases: every source to a temp name, then every temp name to its target.
+
+    The plan is journaled (and fsynced) before anything is touched, so an
+    interrupted run can be finished with resume_plan or reverted with
+    undo_plan. Returns (number of files renamed, journal path).
+    """
+    journal_path = Path(journal_dir) / f"{JOURNAL_PREFIX}{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.jsonl"
+    planned = [(source, source.parent / f".{uuid.uuid4().hex}{TEMP_SUFFIX}", target)
+               for source, target in entries if source != target]
+    _append(journal_path, {'entries': [[str(p) for p in entry] for entry in planned]})
+
+    moved = []
+    for source, temp, target in planned:
+        try:
+            os.rename(source, temp)
+            moved.append((source, temp, target))
+        except OSError as e:
+            print(f"Error renaming {source.name}: {e}")
+    _append(journal_path, {'phase': 'temp'})
+
+    renamed = 0
+    for source, temp, target in moved:
+        try:
+            # Only something created outside this run can be in the way now
+            if os.path.lexists(target):
+                raise FileExistsError(f"'{target.name}' appeared during the rename")
+            os.rename(temp, target)
+        except OSError as e:
+            print(f"Error renaming {source.name}: {e}")
+            try:
+                os.rename(temp, source)
+            except OSError:
+                print(f"Left {source.name} as {temp.name}; run rename_plan.py to resume or undo")
+            continue
+        renamed += 1
+        if on_renamed is not None:
+            on_renamed(source, target)
+    _append(journal_path, {'phase': 'done'})
+    return renamed, journal_path
+
+def resume_plan(journal_path: Path) -> int:
+    """Finish an interrupted run: move every file still at its source or temp name to its target."""
+    entries, _ = read_journal(journal_path)
+    renamed = 0
+    for source, temp, target in entries:
+        current = temp if os.path.lexists(temp) else source if os.path.lexists(source) else None
+        if current is None or os.path.lexists(target):
+            continue
+        try:
+            os.rename(current, target)
+            renamed += 1
+        except OSError as e:
+            print(f"Error renaming {current.name}: {e}")
+    _append(journal_path, {'phase': 'done'})
+    return renamed
+
+def undo_plan(journal_path: Path) -> int:
+    """Revert a run (finished or not): move every file back to its original name."""
+    entries, _ = read_journal(journal_path)
+    restored = 0
+    for source, temp, target in reversed(entries):
+        current = target if os.path.lexists(target) else temp if os.path.lexists(temp) else None
+        if current is None or os.path.lexists(source):
+            continue
+        try:
+            os.rename(current, source)
+            restored += 1
+        except OSError as e:
+            print(f"Error restoring {source.name}: {e}")
+    _append(journal_path, {'phase': 'undone'})
+    return restored
+
+def main():
+    journal = Path(input("Enter the rename journal path (.rename_journal_*.jsonl): ").strip()).expanduser()
+    if not journal.is_file():
+        print(f"Error: '{journal}' is not a file")
+        return
+
+    entries, phase = read_journal(journal)
+    print(f"Journal with {len(entries)} planned renames, last phase: {phase or 'started'}")
+    action = input("Resume (r) or undo (u) this run? ").strip().lower()
+    if action.startswith('r'):
+        print(f"{resume_plan(journal)} files renamed")
+    elif action.startswith('u'):
+        print(f"{undo_plan(journal)} files restored")
+    else:
+        print("Operation cancelled")
+
+if __name__ == "__main__":
+    main()
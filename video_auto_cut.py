@@ -1,6 +1,37 @@
 import os
+import re
 import subprocess
 import json
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from conversion_manifest import write_atomic
+from media_cache import MediaCache
+from video_keyframes import (SMART_RENDER_ENCODERS, copied_clip_starts, half_frame, keyframe_index, plan_cuts,
+                             smart_render_clip, trim_clip, video_codec)
+
+BLACKDETECT = "blackdetect=d={duration}:pic_th=0.98:pix_th=0.1"
+BLACK_MIN_DURATION = 0.5
+BLACK_PATTERN = re.compile(r"black_start:\s*([\d.]+)\s+black_end:\s*([\d.]+)")
+TIME_PATTERN = re.compile(r"time=(\d+):(\d+):([\d.]+)")
+# Fast analysis scales frames to this width before blackdetect; the
+# thresholds are averages, so they hold at any size
+ANALYSIS_WIDTH = 320
+# Analysis frame rate offered for fast mode; boundaries are then refined
+# by decoding this many seconds either side at the full frame rate
+ANALYSIS_FPS = 5
+REFINE_MARGIN = 0.5
+PROGRESS_INTERVAL = 1.0
+STDERR_TAIL = 5
+VIDEO_EXTENSIONS = {'.mp4', '.mov', '.mkv', '.avi', '.m4v', '.ts', '.mts', '.m2ts'}
+# Batch mode: each analysis gets this many decoder threads out of the core
+# budget; a stream-copy split needs about one core
+ANALYSIS_THREADS = 4
+# Batch mode disk budget, in sequential streams: a split copies the whole
+# file at disk speed, an analysis only reads at decode speed
+DISK_COST = {'analyse': 1, 'split': 2}
+DEFAULT_DISK_BUDGET = 4
+REPORT_NAME = 'video_auto_cut_report.json'
 
 def create_output_folder(video_path):
     folder_name = os.path.splitext(os.path.basename(video_path))[0]
@@ -8,64 +39,316 @@ def create_output_folder(video_path):
     os.makedirs(output_folder, exist_ok=True)
     return output_folder
 
-def detect_black_frames(video_path):
-    # Normalize Windows paths
-    escaped_path = video_path.replace("\\", "/")
-    
+def probe_duration(video_path):
+    """Container duration in seconds from ffprobe, or None if it cannot be read."""
+    result = subprocess.run(
+        ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "json", video_path],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    try:
+        return float(json.loads(result.stdout)["format"]["duration"])
+    except (ValueError, KeyError, TypeError):
+        return None
+
+def stream_ffmpeg(ffmpeg_command, on_line):
+    """Run ffmpeg and hand each stderr line to on_line as it is printed.
+
+    The \r-terminated stats lines count as lines too (universal newlines),
+    so on_line sees the running time= position. Returns the exit code and
+    the last STDERR_TAIL lines for error messages.
+    """
+    process = subprocess.Popen(ffmpeg_command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                               text=True, errors='replace', bufsize=1)
+    tail = deque(maxlen=STDERR_TAIL)
+    for line in process.stderr:
+        line = line.rstrip()
+        if line:
+            tail.append(line)
+            on_line(line)
+    return process.wait(), list(tail)
+
+def _black_runs(escaped_path, filters, input_options=(), offset=0.0, on_progress=None, on_black=None):
+    """Run blackdetect and return the (black_start, black_end) runs, shifted by offset."""
     ffmpeg_command = [
-        "ffmpeg", "-i", escaped_path,
-        "-vf", "blackdetect=d=0.5:pic_th=0.98:pix_th=0.1",
-        "-an", "-f", "null", "-"
+        "ffmpeg", "-hide_banner", *input_options, "-i", escaped_path,
+        "-vf", ",".join(filters),
+        "-an", "-sn", "-dn", "-f", "null", "-"
     ]
-    
-    result = subprocess.run(ffmpeg_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
     black_frames = []
 
-    # Parse ffmpeg's stderr for black frame details
-    for line in result.stderr.splitlines():
-        if "black_start" in line:
-            parts = line.split()
-            black_start = float([x.split(':')[1] for x in parts if x.startswith("black_start")][0])
-            black_end = float([x.split(':')[1] for x in parts if x.startswith("black_end")][0])
-            black_frames.append((black_start, black_end))
-    
+    def on_line(line):
+        match = BLACK_PATTERN.search(line)
+        if match:
+            run = (float(match.group(1)) + offset, float(match.group(2)) + offset)
+            black_frames.append(run)
+            if on_black:
+                on_black(run)
+            return
+        match = TIME_PATTERN.search(line)
+        if match and on_progress:
+            hours, minutes, seconds = match.groups()
+            on_progress(int(hours) * 3600 + int(minutes) * 60 + float(seconds))
+
+    returncode, tail = stream_ffmpeg(ffmpeg_command, on_line)
+    if returncode != 0:
+        print(f"ffmpeg exited with code {returncode}: {' | '.join(tail)}")
+    return black_frames
+
+def _refine_boundaries(escaped_path, black_frames, step, threads):
+    """Move coarse boundaries found at a reduced frame rate to the exact frame.
+
+    A coarse black_start lies up to one sampling step after the real one and
+    a coarse black_end up to one step after the real end, so a short window
+    around each is decoded again at the full frame rate.
+    """
+    input_options = ["-nostats", "-threads", str(threads)]
+    filters = [f"scale={ANALYSIS_WIDTH}:-2", BLACKDETECT.format(duration=0)]
+    refined = []
+    for black_start, black_end in black_frames:
+        window_start = max(0.0, black_start - step - REFINE_MARGIN)
+        runs = _black_runs(escaped_path, filters,
+                           ["-ss", str(window_start), "-t", str(step + 2 * REFINE_MARGIN), *input_options],
+                           window_start)
+        starts = [start for start, end in runs if end > black_start - step]
+        if starts:
+            black_start = min(black_start, starts[0])
+
+        window_start = max(0.0, black_end - step - REFINE_MARGIN)
+        runs = _black_runs(escaped_path, filters,
+                           ["-ss", str(window_start), "-t", str(step + 2 * REFINE_MARGIN), *input_options],
+                           window_start)
+        ends = [end for start, end in runs if start < black_end]
+        if ends:
+            black_end = ends[-1]
+        refined.append((round(black_start, 3), round(black_end, 3)))
+    return refined
+
+def detect_black_frames(video_path, fast=False, analysis_fps=None, threads=0, verbose=True):
+    """Black segments of a video as (black_start, black_end) pairs in seconds.
+
+    The default decodes and checks every full-size frame. fast=True scales
+    frames down to ANALYSIS_WIDTH before blackdetect and lets ffmpeg pick
+    the decoder threads; with analysis_fps as well, only that many frames
+    per second are checked and each boundary found is refined at the full
+    frame rate. Progress and each segment are printed while ffmpeg runs,
+    unless verbose is False.
+    """
+    # Normalize Windows paths
+    escaped_path = video_path.replace("\\", "/")
+
+    if fast:
+        filters = [f"scale={ANALYSIS_WIDTH}:-2", BLACKDETECT.format(duration=BLACK_MIN_DURATION)]
+        if analysis_fps:
+            # Drop frames before scaling them
+            filters.insert(0, f"fps={analysis_fps}")
+        input_options = ["-threads", str(threads), "-filter_threads", str(threads or os.cpu_count() or 1)]
+    else:
+        filters = [BLACKDETECT.format(duration=BLACK_MIN_DURATION)]
+        input_options = []
+
+    duration = probe_duration(escaped_path)
+    last_report = 0.0
+    found = []
+
+    def on_progress(position):
+        nonlocal last_report
+        now = time.monotonic()
+        if now - last_report < PROGRESS_INTERVAL:
+            return
+        last_report = now
+        done = f"{100 * position / duration:5.1f}%" if duration else f"{position:.0f}s"
+        print(f"\rAnalysing: {done}, {len(found)} black segments so far", end="", flush=True)
+
+    def on_black(run):
+        found.append(run)
+        print(f"\rBlack segment {len(found)}: {run[0]:.2f}s - {run[1]:.2f}s")
+
+    if verbose:
+        black_frames = _black_runs(escaped_path, filters, input_options, on_progress=on_progress, on_black=on_black)
+        print()
+    else:
+        black_frames = _black_runs(escaped_path, filters, ["-nostats", *input_options])
+
+    if fast and analysis_fps and black_frames:
+        if verbose:
+            print(f"Refining {len(black_frames)} segments at full frame rate...")
+        black_frames = _refine_boundaries(escaped_path, black_frames, 1 / analysis_fps, threads)
+
     return black_frames
 
 
-def split_video(video_path, black_frames, output_folder):
+def clip_timestamps(black_frames):
+    """Clip boundaries: the start, every black_end, and None for the end of the file."""
     black_frames = sorted(set(black_frames))
-    timestamps = [0] + [end for _, end in black_frames] + [None]  # Add start and end timestamps
+    ends = sorted({end for _, end in black_frames if end > 0})
+    return [0] + ends + [None]  # Add start and end timestamps
+
+def split_video_single_pass(video_path, timestamps, output_folder, time_delta=0.0, verbose=True):
+    """Write every clip in one read of the input with ffmpeg's segment muxer.
+
+    A clip starts at the first keyframe no earlier than time_delta before
+    its timestamp, so keyframe times rounded by ffprobe still cut there.
+    Returns the clip paths, or None if ffmpeg failed (the partial clips
+    are removed so the per-clip fallback starts clean).
+    """
+    clip_count = len(timestamps) - 1
+    clip_pattern = os.path.join(output_folder, "clip_%d.mp4")
+    ffmpeg_command = [
+        "ffmpeg", "-hide_banner", "-nostats", "-i", video_path,
+        "-c", "copy", "-f", "segment",
+        "-segment_start_number", "1", "-reset_timestamps", "1",
+    ]
+    if clip_count > 1:
+        ffmpeg_command += ["-segment_times", ",".join(str(t) for t in timestamps[1:-1])]
+    if time_delta:
+        ffmpeg_command += ["-segment_time_delta", str(time_delta)]
+    ffmpeg_command.append(clip_pattern)
+    clip_paths = [clip_pattern % (i + 1) for i in range(clip_count)]
+    written = 0
 
+    def on_line(line):
+        nonlocal written
+        if "for writing" in line:
+            written += 1
+            if verbose:
+                print(f"Writing clip {written}/{clip_count}")
+
+    returncode, tail = stream_ffmpeg(ffmpeg_command, on_line)
+    if returncode != 0:
+        print(f"Error splitting in one pass: {' | '.join(tail)}")
+        for clip_path in clip_paths:
+            if os.path.exists(clip_path):
+                os.remove(clip_path)
+        return None
+    # Counted from ffmpeg's log, so clips left over from an earlier run are not included
+    return [clip_path for clip_path in clip_paths[:written] if os.path.exists(clip_path)]
+
+def split_video_per_clip(video_path, timestamps, output_folder, time_delta=0.0, verbose=True):
+    """One ffmpeg per clip, seeking on the input side so each run reads only its own part.
+
+    Seeks go time_delta past each start, so a start on a keyframe whose
+    time ffprobe rounded down still lands on that keyframe.
+    """
     clips = []
     for i in range(len(timestamps) - 1):
-        start = timestamps[i]
+        start = timestamps[i] + time_delta if timestamps[i] else 0
         end = timestamps[i + 1]
 
         clip_path = os.path.join(output_folder, f"clip_{i + 1}.mp4")
-        
+
         if end is None:
             ffmpeg_command = [
-                "ffmpeg", "-i", video_path, "-ss", str(start),
+                "ffmpeg", "-ss", str(start), "-i", video_path,
                 "-c", "copy", clip_path
             ]
         else:
             ffmpeg_command = [
-                "ffmpeg", "-i", video_path, "-ss", str(start), "-to", str(end),
+                "ffmpeg", "-ss", str(start), "-i", video_path, "-t", str(end - timestamps[i]),
                 "-c", "copy", clip_path
             ]
-        
-        print(f"Running command: {' '.join(ffmpeg_command)}")  # Debug log
+
+        if verbose:
+            print(f"Running command: {' '.join(ffmpeg_command)}")  # Debug log
         result = subprocess.run(ffmpeg_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        
+
         if result.returncode != 0:
             print(f"Error splitting clip {i + 1}: {result.stderr}")
         else:
             clips.append(clip_path)
-    
+
     return clips
 
+def split_video(video_path, black_frames, output_folder, single_pass=True, cache=None, verbose=True):
+    """Split the video at the end of each black segment into clip_1.mp4, clip_2.mp4, ...
+
+    single_pass writes all clips from one demux of the input; if that fails,
+    or with single_pass=False, each clip gets its own ffmpeg run. Returns
+    the clip paths and where they really start (then None for the end of
+    the file), from the keyframe index. verbose=False leaves out the
+    per-clip progress.
+
+    Stream copy can only start a clip on a keyframe, and the two modes pick
+    different ones when black_end is not a keyframe: the segment muxer
+    starts at the first keyframe at or after black_end, so the first few
+    frames after the black end up at the tail of the previous clip; a
+    per-clip run seeks to the last keyframe at or before it, so the clip
+    may start with a little black. split_video_snapped avoids both by
+    cutting at keyframes.
+    """
+    timestamps = clip_timestamps(black_frames)
+    clips = None
+    if single_pass:
+        clips = split_video_single_pass(video_path, timestamps, output_folder, verbose=verbose)
+        if clips is None:
+            print("Falling back to one ffmpeg run per clip...")
+    seek = clips is None
+    if seek:
+        clips = split_video_per_clip(video_path, timestamps, output_folder, verbose=verbose)
+    try:
+        keyframes = keyframe_index(video_path, cache)
+    except RuntimeError as e:
+        print(f"Could not read the keyframe index ({e}); reporting the requested cut times")
+        return clips, timestamps
+    return clips, copied_clip_starts(timestamps, keyframes, seek) if keyframes else timestamps
+
+
+def split_video_snapped(video_path, black_frames, output_folder, single_pass=True, cache=None, verbose=True):
+    """split_video with every cut moved to a keyframe inside its black gap, so stream copy is exact.
+
+    Gaps without a keyframe are cut at black_end: the clip is copied from
+    the next keyframe on and the frames before it are re-encoded and
+    prepended (smart render), after which the previous clip is trimmed back
+    to black_end. Everything else stays stream copy. If the copy did not
+    produce one clip per cut, nothing is re-encoded or trimmed, since the
+    clips could not be matched to their cuts. Returns the clip paths and
+    the boundaries the clips really have, as split_video does.
+    """
+    if verbose:
+        print("Reading keyframe index...")
+    keyframes = keyframe_index(video_path, cache)
+    cuts = plan_cuts(black_frames, keyframes)
+    codec = video_codec(video_path)
+    time_delta = half_frame(codec)
+    # Clips are first copied from a keyframe: the cut itself or the next one
+    copy_starts = [0] + [cut.keyframe for cut in cuts]
+    timestamps = copy_starts + [None]
+    clips = None
+    if single_pass:
+        clips = split_video_single_pass(video_path, timestamps, output_folder, time_delta, verbose)
+        if clips is None:
+            print("Falling back to one ffmpeg run per clip...")
+    if clips is None:
+        clips = split_video_per_clip(video_path, timestamps, output_folder, time_delta, verbose)
+
+    to_render = [i for i, cut in enumerate(cuts) if not cut.snapped]
+    if verbose:
+        print(f"{len(cuts) - len(to_render)} of {len(cuts)} cuts snapped to keyframes.")
+    if not to_render:
+        return clips, timestamps
+    expected = [os.path.join(output_folder, f"clip_{i + 1}.mp4") for i in range(len(cuts) + 1)]
+    if clips != expected:
+        print(f"Expected {len(expected)} clips but {len(clips)} were written; "
+              f"{len(to_render)} clips start at the next keyframe instead.")
+        return clips, timestamps
+    if codec is None or codec.get('codec_name') not in SMART_RENDER_ENCODERS:
+        print(f"Cannot re-encode {codec and codec.get('codec_name')} video; "
+              f"{len(to_render)} clips start at the next keyframe instead.")
+        return clips, timestamps
 
-def main(video_path):
+    # Where each clip starts; a clip only moves back to its cut once its head is rendered
+    starts = list(copy_starts)
+    for i in to_render:
+        cut = cuts[i]
+        if verbose:
+            print(f"Smart-rendering {cut.keyframe - cut.time:.2f}s at the start of clip {i + 2}...")
+        try:
+            smart_render_clip(video_path, clips[i + 1], cut, codec)
+            starts[i + 1] = cut.time
+            trim_clip(clips[i], cut.time - starts[i])
+        except RuntimeError as e:
+            print(f"Error smart-rendering clip {i + 2}: {e}")
+    return clips, starts + [None]
+
+def main(video_path, fast=False, analysis_fps=None, single_pass=True, snap=True):
     if not os.path.isfile(video_path):
         print("Invalid video file path.")
         return
@@ -76,7 +359,7 @@ def main(video_path):
 
     # Detect black frames
     print("Detecting black frames...")
-    black_frames = detect_black_frames(video_path)
+    black_frames = detect_black_frames(video_path, fast, analysis_fps)
 
     if not black_frames:
         print("No black frames detected. Exiting.")
@@ -86,14 +369,132 @@ def main(video_path):
 
     # Split video
     print("Splitting video into clips...")
-    clips = split_video(video_path, black_frames, output_folder)
+    if snap:
+        with MediaCache() as cache:
+            clips, _ = split_video_snapped(video_path, black_frames, output_folder, single_pass, cache)
+    else:
+        clips, _ = split_video(video_path, black_frames, output_folder, single_pass)
 
     print(f"Video successfully split into {len(clips)} clips.")
     print("Clips saved to:")
     for clip in clips:
         print(clip)
 
+def find_videos(root):
+    """Video files under root, skipping the clip folders this script creates next to each video."""
+    videos = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        names = [f for f in filenames if os.path.splitext(f)[1].lower() in VIDEO_EXTENSIONS]
+        stems = {os.path.splitext(f)[0] for f in names}
+        dirnames[:] = sorted(d for d in dirnames if d not in stems)
+        videos.extend(os.path.join(dirpath, f) for f in sorted(names))
+    return videos
+
+def run_batch(root, analysis_fps=None, single_pass=True, snap=True, cores=None,
+              disk_budget=DEFAULT_DISK_BUDGET):
+    """Analyse and split every video under root on one scheduler and write a JSON report.
+
+    Analyses (fast mode, ANALYSIS_THREADS threads each) and splits share a
+    budget of cores and one of disk streams (DISK_COST), so the analysis of
+    the next videos runs while earlier ones are being split. Splits are
+    started first, since they finish a video. A job larger than a budget
+    still runs when nothing else does. The report, REPORT_NAME in root,
+    lists the black segments, clip boundaries and clips of every file.
+    """
+    cores = cores or os.cpu_count() or 1
+    # A core is always left for splitting, so analysis and splitting can overlap
+    analysis_threads = max(1, min(cores - 1, ANALYSIS_THREADS))
+    videos = find_videos(root)
+    print(f"Found {len(videos)} videos under {root}")
+    records = {video: {'path': os.path.abspath(video), 'status': 'pending'} for video in videos}
+    pending = deque(videos)
+    to_split = deque()
+    running = {}
+    free_cores, free_disk = cores, disk_budget
+
+    def analyse(video):
+        started = time.perf_counter()
+        black_frames = detect_black_frames(video, True, analysis_fps, analysis_threads, verbose=False)
+        return black_frames, probe_duration(video), time.perf_counter() - started
+
+    def split(video, black_frames):
+        started = time.perf_counter()
+        output_folder = create_output_folder(video)
+        if snap:
+            clips, boundaries = split_video_snapped(video, black_frames, output_folder, single_pass, cache,
+                                                    verbose=False)
+        else:
+            clips, boundaries = split_video(video, black_frames, output_folder, single_pass, cache, verbose=False)
+        return clips, boundaries, time.perf_counter() - started
+
+    def fits(stage):
+        cpu = analysis_threads if stage == 'analyse' else 1
+        return not running or (cpu <= free_cores and DISK_COST[stage] <= free_disk)
+
+    def start(stage, video, *args):
+        nonlocal free_cores, free_disk
+        cpu = analysis_threads if stage == 'analyse' else 1
+        free_cores -= cpu
+        free_disk -= DISK_COST[stage]
+        task = analyse if stage == 'analyse' else split
+        running[executor.submit(task, video, *args)] = (stage, video, cpu)
+
+    with MediaCache() as cache, ThreadPoolExecutor(max_workers=cores + disk_budget) as executor:
+        while pending or to_split or running:
+            while to_split and fits('split'):
+                start('split', *to_split.popleft())
+            while pending and fits('analyse'):
+                start('analyse', pending.popleft())
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, video, cpu = running.pop(future)
+                free_cores += cpu
+                free_disk += DISK_COST[stage]
+                record = records[video]
+                error = future.exception()
+                if error is not None:
+                    print(f"Error in {stage} of {video}: {error}")
+                    record.update(status='failed', error=f"{stage}: {error}")
+                elif stage == 'analyse':
+                    black_frames, duration, seconds = future.result()
+                    record.update(black_frames=[list(run) for run in black_frames], duration=duration,
+                                  analysis_seconds=round(seconds, 1))
+                    print(f"Analysed {os.path.basename(video)}: {len(black_frames)} black segments")
+                    if black_frames:
+                        record['status'] = 'analysed'
+                        to_split.append((video, black_frames))
+                    else:
+                        record.update(status='no_black_frames', segments=[[0, duration]])
+                else:
+                    # The boundaries the split really used, e.g. after snapping to keyframes
+                    clips, boundaries, seconds = future.result()
+                    record.update(status='split', clips=clips, split_seconds=round(seconds, 1),
+                                  segments=[[clip_start, clip_end if clip_end is not None else record['duration']]
+                                            for clip_start, clip_end in zip(boundaries, boundaries[1:])])
+                    print(f"Split {os.path.basename(video)} into {len(clips)} clips")
+
+    report_path = os.path.join(root, REPORT_NAME)
+    report = {'root': os.path.abspath(root), 'cores': cores, 'disk_budget': disk_budget,
+              'videos': [records[video] for video in videos]}
+    write_atomic(report_path, json.dumps(report, indent=2).encode('utf-8'))
+    print(f"Report saved to {report_path}")
+    return report
+
 if __name__ == "__main__":
-    video_path_input = input("Enter the path to the video file: ").strip()
+    video_path_input = input("Enter the path to the video file (or a folder for batch mode): ").strip()
     # video_path_input = video_path_input.replace("\\", "/")  # Normalize Windows paths
-    main(video_path_input)
+    batch_input = os.path.isdir(video_path_input)
+    # Batch mode always analyses in fast mode, on a share of the cores
+    fast_input = batch_input or input("Fast analysis (downscaled, threaded)? (y/n, default y): ").strip().lower() != 'n'
+    fps_input = None
+    if fast_input:
+        fps_input = float(input(f"Analysis frame rate (e.g. {ANALYSIS_FPS}; press Enter for every frame): ") or 0) or None
+    single_pass_input = input("Write all clips in one pass? (y/n, default y): ").strip().lower() != 'n'
+    snap_input = input("Snap cuts to keyframes (re-encoding only where a gap has none)? (y/n, default y): ").strip().lower() != 'n'
+    if batch_input:
+        cores_input = int(input(f"CPU cores to use (default {os.cpu_count()}): ") or os.cpu_count())
+        disk_input = int(input(f"Concurrent disk streams (default {DEFAULT_DISK_BUDGET}): ") or DEFAULT_DISK_BUDGET)
+        run_batch(video_path_input, fps_input, single_pass_input, snap_input, cores_input, disk_input)
+    else:
+        main(video_path_input, fast_input, fps_input, single_pass_input, snap_input)
@@ -0,0 +1,197 @@
+import argparse
+import bisect
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from typing import List, Optional
+from media_cache import MediaCache
+from video_auto_cut import probe_duration
+from video_keyframes import concat_copy, half_frame, keyframe_index, video_codec
+
+ENCODERS = ('libx264', 'libx265')
+DEFAULT_ENCODER = 'libx264'
+DEFAULT_CRF = 20
+DEFAULT_PRESET = 'medium'
+# x264/x265 scale well up to about this many threads per process; more
+# cores are better spent on more chunks side by side
+DEFAULT_CHUNK_THREADS = 4
+# Chunks per concurrent encoder, so one slow chunk does not leave cores idle at the end
+CHUNKS_PER_WORKER = 3
+STDERR_TAIL = 500
+
+def chunk_boundaries(keyframes: List[float], duration: float, chunk_count: int) -> List[float]:
+    """Keyframes nearest to chunk_count equal divisions of the duration, without duplicates or 0."""
+    boundaries = []
+    for i in range(1, chunk_count):
+        target = duration * i / chunk_count
+        j = bisect.bisect_left(keyframes, target)
+        nearest = min(keyframes[max(0, j - 1):j + 1], key=lambda k: abs(k - target), default=None)
+        if nearest and (not boundaries or nearest > boundaries[-1]):
+            boundaries.append(nearest)
+    return boundaries
+
+def encoder_options(encoder: str, crf: int, preset: str, threads: int) -> List[str]:
+    options = ["-c:v", encoder, "-crf", str(crf), "-preset", preset]
+    if encoder == 'libx265':
+        # libx265 ignores -threads; its thread pool is sized here
+        options += ["-x265-params", f"pools={threads}:log-level=error"]
+    else:
+        options += ["-threads", str(threads)]
+    return options
+
+class ChunkScheduler:
+    """Runs ffmpeg commands, at most workers at a time, and stops them all on the first failure or Ctrl-C."""
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._processes = set()
+        self._lock = threading.Lock()
+        self._failed = False
+
+    def _run(self, ffmpeg_command, label):
+        with self._lock:
+            if self._failed:
+                raise RuntimeError("cancelled")
+            process = subprocess.Popen(ffmpeg_command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+            self._processes.add(process)
+        try:
+            _, stderr = process.communicate()
+        finally:
+            with self._lock:
+                self._processes.discard(process)
+        if process.returncode != 0:
+            raise RuntimeError(f"{label} failed: {stderr.strip()[-STDERR_TAIL:]}")
+        print(f"{label} done")
+
+    def cancel(self):
+        with self._lock:
+            self._failed = True
+            for process in self._processes:
+                process.kill()
+
+    def run_all(self, commands):
+        """Run (label, ffmpeg_command) pairs; raises the first error after stopping the rest."""
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self._run, command, label) for label, command in commands]
+            try:
+                done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+                errors = [future.exception() for future in done if future.exception() is not None]
+                if errors:
+                    self.cancel()
+                    raise errors[0]
+            except KeyboardInterrupt:
+                self.cancel()
+                raise
+
+def chunked_encode(video_path, output_path, encoder: str = DEFAULT_ENCODER, crf: int = DEFAULT_CRF,
+                   preset: str = DEFAULT_PRESET, chunk_threads: int = DEFAULT_CHUNK_THREADS,
+                   cores: Optional[int] = None, cache=None) -> None:
+    """Re-encode the video stream in keyframe-aligned chunks on several ffmpeg processes at once.
+
+    1. The source is split at keyframes with stream copy, in one pass.
+    2. Chunks are encoded concurrently, cores // chunk_threads at a time,
+       each ffmpeg limited to chunk_threads threads.
+    3. The encoded chunks are joined with the concat demuxer and the
+       source audio is copied in, so nothing is encoded twice.
+    """
+    cores = cores or os.cpu_count() or 1
+    workers = max(1, cores // chunk_threads)
+    duration = probe_duration(video_path)
+    keyframes = keyframe_index(video_path, cache)
+    if not duration or not keyframes:
+        raise RuntimeError("Could not read the duration or keyframes of the video")
+    boundaries = chunk_boundaries(keyframes, duration, workers * CHUNKS_PER_WORKER)
+
+    work_folder = tempfile.mkdtemp(prefix='.chunks_', dir=os.path.dirname(os.path.abspath(output_path)))
+    try:
+        source_pattern = os.path.join(work_folder, "source_%04d.mkv")
+        split_command = ["ffmpeg", "-y", "-hide_banner", "-nostats", "-i", video_path,
+                         "-map", "0:v:0", "-c", "copy", "-f", "segment", "-reset_timestamps", "1"]
+        if boundaries:
+            # Keyframe times are rounded by ffprobe; the delta keeps each cut on its keyframe
+            split_command += ["-segment_times", ",".join(str(t) for t in boundaries),
+                              "-segment_time_delta", str(half_frame(video_codec(video_path)))]
+        split_command.append(source_pattern)
+        print(f"Splitting into {len(boundaries) + 1} chunks at keyframes...")
+        ChunkScheduler(1).run_all([("split", split_command)])
+
+        sources = sorted(name for name in os.listdir(work_folder) if name.startswith('source_'))
+        encoded = [os.path.join(work_folder, name.replace('source_', 'encoded_')) for name in sources]
+        commands = []
+        for name, encoded_path in zip(sources, encoded):
+            commands.append((f"chunk {name[7:11]}",
+                             ["ffmpeg", "-y", "-hide_banner", "-nostats", "-threads", str(chunk_threads),
+                              "-i", os.path.join(work_folder, name),
+                              *encoder_options(encoder, crf, preset, chunk_threads), encoded_path]))
+        print(f"Encoding {len(commands)} chunks, {workers} at a time with {chunk_threads} threads each...")
+        ChunkScheduler(workers).run_all(commands)
+
+        joined = os.path.join(work_folder, "joined.mkv")
+        concat_copy(encoded, joined)
+        ChunkScheduler(1).run_all([("mux", ["ffmpeg", "-y", "-hide_banner", "-nostats",
+                                            "-i", joined, "-i", video_path,
+                                            "-map", "0:v:0", "-map", "1:a?", "-c", "copy", output_path])])
+    finally:
+        shutil.rmtree(work_folder, ignore_errors=True)
+
+def single_encode(video_path, output_path, encoder: str = DEFAULT_ENCODER, crf: int = DEFAULT_CRF,
+                  preset: str = DEFAULT_PRESET) -> None:
+    """The same encode in one ffmpeg process with default threading, for comparison."""
+    ChunkScheduler(1).run_all([("single", ["ffmpeg", "-y", "-hide_banner", "-nostats", "-i", video_path,
+                                           "-map", "0:v:0", "-map", "0:a?",
+                                           "-c:v", encoder, "-crf", str(crf), "-preset", preset,
+                                           "-c:a", "copy", output_path])])
+
+def bench(video_path, encoder: str, crf: int, preset: str, chunk_threads: int, cores: Optional[int] = None):
+    """Wall-clock time and output size of a single-process encode against the chunked one."""
+    work_folder = tempfile.mkdtemp(prefix='.chunk_bench_', dir=os.path.dirname(os.path.abspath(video_path)))
+    try:
+        results = []
+        for label in ('single process', 'chunked'):
+            output_path = os.path.join(work_folder, f"{label.replace(' ', '_')}.mp4")
+            started = time.perf_counter()
+            if label == 'chunked':
+                with MediaCache() as cache:
+                    chunked_encode(video_path, output_path, encoder, crf, preset, chunk_threads, cores, cache)
+            else:
+                single_encode(video_path, output_path, encoder, crf, preset)
+            results.append((label, time.perf_counter() - started, os.path.getsize(output_path)))
+    finally:
+        shutil.rmtree(work_folder, ignore_errors=True)
+
+    print(f"\n{'mode':<16} {'seconds':>9} {'MB':>9}")
+    for label, seconds, size in results:
+        print(f"{label:<16} {seconds:>9.1f} {size / 1e6:>9.1f}")
+    print(f"Speedup: {results[0][1] / results[1][1]:.2f}x")
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-encode a video in parallel keyframe-aligned chunks.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    for name in ('encode', 'bench'):
+        command = subparsers.add_parser(name, help="chunked encode" if name == 'encode'
+                                        else "compare wall-clock time against a single ffmpeg process")
+        command.add_argument('input')
+        if name == 'encode':
+            command.add_argument('output')
+        command.add_argument('--encoder', choices=ENCODERS, default=DEFAULT_ENCODER)
+        command.add_argument('--crf', type=int, default=DEFAULT_CRF)
+        command.add_argument('--preset', default=DEFAULT_PRESET)
+        command.add_argument('--chunk-threads', type=int, default=DEFAULT_CHUNK_THREADS,
+                             help="threads per ffmpeg process")
+        command.add_argument('--cores', type=int, default=None, help="cores to use (default: all)")
+    args = parser.parse_args()
+
+    if args.command == 'encode':
+        with MediaCache() as cache:
+            chunked_encode(args.input, args.output, args.encoder, args.crf, args.preset,
+                           args.chunk_threads, args.cores, cache)
+        print(f"Saved {args.output}")
+    else:
+        bench(args.input, args.encoder, args.crf, args.preset, args.chunk_threads, args.cores)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+import bisect
+import json
+import os
+import subprocess
+import tempfile
+from typing import List, NamedTuple, Optional
+from dedupe import partial_hash
+
+# Encoders used to re-render the frames before the first keyframe of a clip,
+# by source codec. Other codecs are cut at the next keyframe instead.
+SMART_RENDER_ENCODERS = {'h264': 'libx264', 'hevc': 'libx265'}
+SMART_RENDER_CRF = '18'
+SMART_RENDER_PRESET = 'veryfast'
+# Source profiles (as ffprobe names them) by the encoder's name for them, so
+# the re-encoded head needs no more decoder features than the copied rest
+SMART_RENDER_PROFILES = {
+    'h264': {'Constrained Baseline': 'baseline', 'Baseline': 'baseline', 'Main': 'main', 'High': 'high',
+             'High 10': 'high10', 'High 4:2:2': 'high422', 'High 4:4:4 Predictive': 'high444'},
+    'hevc': {'Main': 'main', 'Main 10': 'main10'},
+}
+# MP4 sample entries that allow parameter sets in the stream itself, which
+# the re-encoded head and the copied rest do not share
+IN_BAND_TAGS = {'h264': 'avc3', 'hevc': 'hev1'}
+# Used as the cut tolerance when the frame rate is unknown (half a frame at 50 fps)
+DEFAULT_HALF_FRAME = 0.01
+
+class Cut(NamedTuple):
+    """A planned clip boundary.
+
+    time is where the clip should start and keyframe where a stream copy
+    can start (the first keyframe at or after time). They are equal when
+    the cut was snapped to a keyframe inside the black gap; otherwise the
+    frames in between have to be re-encoded. Both are seconds from the
+    start of the file, as ffmpeg and blackdetect count them.
+    """
+    time: float
+    keyframe: float
+
+    @property
+    def snapped(self) -> bool:
+        return self.keyframe == self.time
+
+def keyframe_index(video_path, cache=None) -> List[float]:
+    """Sorted presentation times of the first video stream's keyframes, in seconds from the start of the file.
+
+    Read from the packet flags with ffprobe, so nothing is decoded. The
+    container start time is subtracted, since ffmpeg shifts timestamps to
+    start at 0 before seeking, splitting or filtering. ffprobe prints times
+    rounded to the microsecond, so cuts at these times need a small
+    tolerance (see half_frame). Cached in the media cache under the file's
+    partial hash (size plus first and last bytes), so a video is only
+    probed once, even after a move.
+    """
+    key = f"keyframes:v2:{partial_hash(video_path)}"
+    if cache is not None:
+        cached = cache.get_derived(key)
+        if cached is not None:
+            return json.loads(cached)
+    result = subprocess.run(
+        ["ffprobe", "-v", "error", "-select_streams", "v:0",
+         "-show_entries", "packet=pts_time,flags:format=start_time", "-of", "csv", video_path],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffprobe failed: {result.stderr.strip()}")
+    # Lines are "packet,pts_time,flags" and one "format,start_time"
+    start_time = 0.0
+    pts_times = set()
+    for line in result.stdout.splitlines():
+        section, _, fields = line.partition(',')
+        if section == 'format':
+            try:
+                start_time = float(fields)
+            except ValueError:
+                pass
+        elif section == 'packet':
+            pts_time, _, flags = fields.partition(',')
+            if 'K' in flags and pts_time not in ('', 'N/A'):
+                pts_times.add(float(pts_time))
+    keyframes = sorted(round(pts_time - start_time, 6) for pts_time in pts_times)
+    if cache is not None:
+        cache.put_derived(key, json.dumps(keyframes))
+    return keyframes
+
+def video_codec(video_path) -> Optional[dict]:
+    """codec_name, profile, level, pix_fmt and avg_frame_rate of the first video stream, or None."""
+    result = subprocess.run(
+        ["ffprobe", "-v", "error", "-select_streams", "v:0",
+         "-show_entries", "stream=codec_name,profile,level,pix_fmt,avg_frame_rate", "-of", "json", video_path],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    try:
+        return json.loads(result.stdout)["streams"][0]
+    except (ValueError, KeyError, IndexError):
+        return None
+
+def half_frame(codec: Optional[dict]) -> float:
+    """Half the frame interval of the stream, the tolerance used when cutting at a keyframe time."""
+    numerator, _, denominator = ((codec or {}).get('avg_frame_rate') or '').partition('/')
+    try:
+        return 0.5 * float(denominator or 1) / float(numerator)
+    except (ValueError, ZeroDivisionError):
+        return DEFAULT_HALF_FRAME
+
+def plan_cuts(black_frames, keyframes: List[float]) -> List[Cut]:
+    """One Cut per black segment, snapped to the last keyframe inside the gap where there is one.
+
+    Cutting anywhere inside a black gap loses nothing, so the latest
+    keyframe in [black_start, black_end] is used. A gap without a keyframe
+    is cut at black_end, to be smart-rendered up to the next keyframe.
+
+    Every clip is first copied from its own keyframe, so a gap with no
+    keyframe after it, or one sharing the next keyframe with the gap
+    before, cannot be cut by stream copy and is left out.
+    """
+    cuts = []
+    for black_start, black_end in sorted(set(black_frames)):
+        if black_end <= 0:
+            continue
+        i = bisect.bisect_right(keyframes, black_end)
+        if i and keyframes[i - 1] >= black_start:
+            cut = Cut(keyframes[i - 1], keyframes[i - 1])
+        elif i < len(keyframes):
+            cut = Cut(black_end, keyframes[i])
+        else:
+            break
+        if not cuts or cut.keyframe > cuts[-1].keyframe:
+            cuts.append(cut)
+    return cuts
+
+def _run(ffmpeg_command):
+    # Commands run with -hide_banner -v error, so the stderr tail is the error itself
+    result = subprocess.run(ffmpeg_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"{' '.join(ffmpeg_command[:2])}... failed: {result.stderr.strip()[-500:]}")
+
+def concat_copy(parts: List[str], output_path, options: List[str] = ()) -> None:
+    """Join files with the concat demuxer, without re-encoding. options go before the output path."""
+    with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False, encoding='utf-8') as list_file:
+        for part in parts:
+            escaped = os.path.abspath(part).replace("\\", "/").replace("'", "'\\''")
+            list_file.write(f"file '{escaped}'\n")
+    try:
+        _run(["ffmpeg", "-y", "-hide_banner", "-v", "error", "-f", "concat", "-safe", "0", "-i", list_file.name,
+              "-c", "copy", *options, output_path])
+    finally:
+        os.remove(list_file.name)
+
+def copied_clip_starts(timestamps: List[Optional[float]], keyframes: List[float], seek: bool) -> List[Optional[float]]:
+    """Where stream-copied clips cut at timestamps (0, cuts..., None) really start.
+
+    The segment muxer starts a clip at the first keyframe at or after its
+    cut and cannot cut after the last keyframe; an input-side seek (seek)
+    starts at the last keyframe at or before it. The frames in between end
+    up at the tail of the previous clip, or the head of this one.
+    """
+    starts = [0]
+    for time in timestamps[1:-1]:
+        if seek:
+            i = bisect.bisect_right(keyframes, time)
+            starts.append(keyframes[i - 1] if i else 0)
+            continue
+        i = bisect.bisect_left(keyframes, time)
+        if i == len(keyframes):
+            break
+        # Cuts that land on the same keyframe make one clip
+        if keyframes[i] > starts[-1]:
+            starts.append(keyframes[i])
+    return starts + [None]
+
+def _profile_options(codec: dict) -> List[str]:
+    # Level as the encoders take it: ffprobe reports 10x the level for H.264, 30x for HEVC
+    profile = SMART_RENDER_PROFILES[codec['codec_name']].get(codec.get('profile'))
+    level = codec.get('level') or 0
+    options = ["-profile:v", profile] if profile else []
+    if codec['codec_name'] == 'h264' and level > 9:
+        options += ["-level:v", f"{level / 10:.1f}"]
+    elif codec['codec_name'] == 'hevc' and level > 0:
+        options += ["-x265-params", f"level-idc={level / 30:.1f}:log-level=error"]
+    return options
+
+def smart_render_clip(video_path, clip_path, cut: Cut, codec: dict) -> None:
+    """Prepend the frames from cut.time to cut.keyframe, re-encoded, to a clip that starts at cut.keyframe.
+
+    The head is encoded with the source's profile and level where the
+    encoder knows them. Its parameter sets (SPS/PPS) still differ from
+    those of the copied rest. Both parts therefore go through MPEG-TS,
+    which repeats the parameter sets in the stream, and the joined clip is
+    written with an avc3/hev1 sample entry, which tells players to take
+    them from the stream rather than only from the header.
+    """
+    encoder = SMART_RENDER_ENCODERS[codec['codec_name']]
+    folder = os.path.dirname(clip_path)
+    head = os.path.join(folder, f".{os.path.basename(clip_path)}.head.ts")
+    tail = os.path.join(folder, f".{os.path.basename(clip_path)}.tail.ts")
+    joined = f"{clip_path}.part.mp4"
+    try:
+        _run(["ffmpeg", "-y", "-hide_banner", "-v", "error", "-ss", str(cut.time), "-i", video_path,
+              "-t", str(round(cut.keyframe - cut.time, 6)),
+              "-map", "0:v:0", "-map", "0:a?", "-c:v", encoder, "-crf", SMART_RENDER_CRF,
+              "-preset", SMART_RENDER_PRESET, *_profile_options(codec), "-pix_fmt", codec.get('pix_fmt') or 'yuv420p',
+              "-c:a", "copy", "-f", "mpegts", head])
+        _run(["ffmpeg", "-y", "-hide_banner", "-v", "error", "-i", clip_path, "-map", "0:v:0", "-map", "0:a?",
+              "-c", "copy", "-f", "mpegts", tail])
+        concat_copy([head, tail], joined, ["-tag:v", IN_BAND_TAGS[codec['codec_name']]])
+        os.replace(joined, clip_path)
+    finally:
+        for path in (head, tail, joined):
+            if os.path.exists(path):
+                os.remove(path)
+
+def trim_clip(clip_path, duration: float) -> None:
+    """Cut a stream-copied clip short at duration seconds; a copy can end between keyframes."""
+    trimmed = f"{clip_path}.part.mp4"
+    try:
+        _run(["ffmpeg", "-y", "-hide_banner", "-v", "error", "-i", clip_path, "-t", str(round(duration, 6)),
+              "-c", "copy", trimmed])
+        os.replace(trimmed, clip_path)
+    finally:
+        if os.path.exists(trimmed):
+            os.remove(trimmed)